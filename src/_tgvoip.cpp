@@ -19,17 +19,206 @@
  */
 
 
+#ifdef _WIN32
+#include <winsock2.h>  // must precede windows.h pulled in by libtgvoip
+#else
+#include <sys/socket.h>
+#endif
 #include "_tgvoip.h"
+#include <pybind11/numpy.h>
+#include <algorithm>
+#include <chrono>
 #include <iostream>
 #include <utility>
-// #include <chrono>
+
+static py::memoryview audio_frame_memoryview(int16_t *buf, size_t size, bool readonly) {
+    Py_buffer info {};
+    info.buf = buf;
+    info.len = static_cast<Py_ssize_t>(sizeof(int16_t) * size);
+    info.itemsize = sizeof(int16_t);
+    info.format = (char *)"h";
+    info.ndim = 1;
+    info.readonly = readonly;
+    PyObject *view = PyMemoryView_FromBuffer(&info);
+    if (view == nullptr)
+        throw py::error_already_set();
+    return py::reinterpret_steal<py::memoryview>(view);
+}
+
+// copies a field of every row into a typed memoryview over a new bytes object, GIL must be held
+template<typename S, typename T>
+static py::memoryview column_memoryview(const std::vector<S> &rows, T S::*field, const char *format) {
+    std::vector<T> column;
+    column.reserve(rows.size());
+    for (auto &row : rows)
+        column.push_back(row.*field);
+    py::bytes data((const char *) column.data(), sizeof(T) * column.size());
+    return py::memoryview(data).attr("cast")(format);
+}
+
+// wraps a copy of frame memory, views kept by the callback only alias the copy, GIL must be held
+static py::memoryview audio_frame_copy_memoryview(const int16_t *buf, size_t size, bool readonly) {
+    const char *data = reinterpret_cast<const char *>(buf);
+    auto length = static_cast<Py_ssize_t>(sizeof(int16_t) * size);
+    PyObject *copy = readonly ? PyBytes_FromStringAndSize(data, length) : PyByteArray_FromStringAndSize(data, length);
+    if (copy == nullptr)
+        throw py::error_already_set();
+    return py::memoryview(py::reinterpret_steal<py::object>(copy)).attr("cast")("h");
+}
+
+class AudioFrameView {
+public:
+    // wraps native frame memory without copying unless a callback has kept an earlier frame, GIL must be held
+    AudioFrameView(int16_t *buf, size_t size, bool readonly, bool ndarray, std::atomic<bool> &copy)
+            : view(copy ? audio_frame_copy_memoryview(buf, size, readonly)
+                        : audio_frame_memoryview(buf, size, readonly)),
+              frame(view), buf(buf), size(size), readonly(readonly), copied(copy), copy(copy) {
+        if (ndarray) {
+            // array is built over the view's buffer (and inherits its read-only flag), so it's tracked like a slice
+            frame = py::module::import("numpy").attr("frombuffer")(view, py::dtype::of<int16_t>());
+        }
+    }
+
+    // native memory is reused after the callback returns, so neither the view nor anything derived from it
+    // (slices, arrays) may outlive it, should be called once the callback returned
+    void release() {
+        if (released)
+            return;
+        released = true;
+        frame = py::object();
+        if (copied) {
+            if (!readonly)
+                memcpy(buf, PyMemoryView_GET_BUFFER(view.ptr())->buf, sizeof(int16_t) * size);
+            return;
+        }
+        // derived views share the managed buffer and stay usable after the view itself is released
+        bool derived = ((PyMemoryViewObject *) view.ptr())->mbuf->exports > 1;
+        PyObject *res = PyObject_CallMethod(view.ptr(), "release", nullptr);
+        if (res == nullptr)
+            PyErr_Clear();
+        Py_XDECREF(res);
+        if (derived || res == nullptr) {
+            // kept views keep aliasing this buffer, but at least they won't alias any of the later frames
+            copy = true;
+            if (PyErr_WarnEx(PyExc_RuntimeWarning, "audio frame is still referenced after callback returned, "
+                                                   "frames are copied from now on", 1) == -1)
+                PyErr_WriteUnraisable(view.ptr());
+        }
+    }
+
+    // callback raised, its traceback might still reference the frame
+    ~AudioFrameView() {
+        release();
+    }
+
+    py::memoryview view;
+    py::object frame;
+
+private:
+    int16_t *buf;
+    size_t size;
+    bool readonly;
+    bool copied;
+    bool released = false;
+    std::atomic<bool> &copy;
+};
+
+// buffers of finished sources are released by the interpreter, audio threads never hold the GIL
+static std::mutex released_buffers_mutex;
+static std::vector<Py_buffer *> released_buffers;
+static bool buffers_release_scheduled = false;
+
+static int release_buffers(void *) {
+    std::vector<Py_buffer *> buffers;
+    {
+        std::lock_guard<std::mutex> lock(released_buffers_mutex);
+        std::swap(buffers, released_buffers);
+        buffers_release_scheduled = false;
+    }
+    for (Py_buffer *buffer : buffers) {
+        PyBuffer_Release(buffer);
+        delete buffer;
+    }
+    return 0;
+}
+
+class PyBufferSource : public AudioSource {
+public:
+    // keeps a reference to the exporting object and reads its memory directly, GIL must be held
+    explicit PyBufferSource(const py::buffer &data) : buffer(new Py_buffer) {
+        if (PyObject_GetBuffer(data.ptr(), buffer, PyBUF_C_CONTIGUOUS) != 0) {
+            delete buffer;
+            throw py::error_already_set();
+        }
+    }
+
+    // might be called without the GIL
+    ~PyBufferSource() override {
+        std::lock_guard<std::mutex> lock(released_buffers_mutex);
+        released_buffers.push_back(buffer);
+        if (!buffers_release_scheduled)
+            buffers_release_scheduled = Py_AddPendingCall(release_buffers, nullptr) == 0;
+    }
+
+    size_t read(int16_t *buf, size_t size) override {
+        size_t count = std::min(size, (static_cast<size_t>(buffer->len) - position) / sizeof(int16_t));
+        if (count == 0)
+            return 0;
+        memcpy(buf, static_cast<const uint8_t *>(buffer->buf) + position, sizeof(int16_t) * count);
+        position += sizeof(int16_t) * count;
+        return count;
+    }
+
+    void rewind() override {
+        position = 0;
+    }
+
+private:
+    Py_buffer *buffer;
+    size_t position = 0;
+};
 
 Endpoint::Endpoint(int64_t id, std::string ip, std::string ipv6, uint16_t port, const std::string &peer_tag)
     : id(id), ip(std::move(ip)), ipv6(std::move(ipv6)), port(port), peer_tag(peer_tag) {}
 
-VoIPController::VoIPController() {
+GilTiming &GilTiming::process() {
+    static GilTiming timing;
+    return timing;
+}
+
+GilStats GilTiming::get_stats() const {
+    return GilStats {wait.get_stats(), hold.get_stats()};
+}
+
+void GilTiming::reset() {
+    wait.reset();
+    hold.reset();
+}
+
+TimedGilAcquire::TimedGilAcquire(GilTiming &timing)
+        : timing(timing), nested(PyGILState_Check() != 0), start(std::chrono::steady_clock::now()),
+          acquired(std::chrono::steady_clock::now()) {
+    if (nested)
+        return;
+    uint64_t us = std::chrono::duration_cast<std::chrono::microseconds>(acquired - start).count();
+    timing.wait.record(us);
+    GilTiming::process().wait.record(us);
+}
+
+TimedGilAcquire::~TimedGilAcquire() {
+    if (nested)
+        return;
+    auto released = std::chrono::steady_clock::now();
+    uint64_t us = std::chrono::duration_cast<std::chrono::microseconds>(released - acquired).count();
+    timing.hold.record(us);
+    GilTiming::process().hold.record(us);
+}
+
+std::mutex VoIPController::registry_mutex;
+std::unordered_set<VoIPController *> VoIPController::registry;
+
+VoIPController::VoIPController() : send_buffer(48000), recv_buffer(48000) {
     ctrl = nullptr;
-    output_file = nullptr;
     native_io = false;
 }
 
@@ -41,12 +230,16 @@ VoIPController::VoIPController(const std::string &_persistent_state_file) : VoIP
 void VoIPController::init() {
     ctrl = new tgvoip::VoIPController();
     ctrl->implData = (void *)this;
+    {
+        std::lock_guard<std::mutex> lock(registry_mutex);
+        registry.insert(this);
+    }
     tgvoip::VoIPController::Callbacks callbacks {};
     callbacks.connectionStateChanged = [](tgvoip::VoIPController *ctrl, int state) {
-        ((VoIPController *)ctrl->implData)->_handle_state_change(CallState(state));
+        ((VoIPController *)ctrl->implData)->_on_state_change(state);
     };
     callbacks.signalBarCountChanged = [](tgvoip::VoIPController *ctrl, int count) {
-        ((VoIPController *)ctrl->implData)->_handle_signal_bars_change(count);
+        ((VoIPController *)ctrl->implData)->_on_signal_bars_change(count);
     };
     callbacks.groupCallKeyReceived = nullptr;
     callbacks.groupCallKeySent = nullptr;
@@ -81,12 +274,24 @@ void VoIPController::init() {
 }
 
 VoIPController::~VoIPController() {
+    {
+        // snapshots never see a controller which is being destroyed
+        std::lock_guard<std::mutex> lock(registry_mutex);
+        registry.erase(this);
+    }
+    {
+        std::lock_guard<std::mutex> lock(event_mutex);
+        events.clear();
+        pending_events.clear();
+    }
+    _set_finished();
+    _stop_event_dispatcher();
+    _stop_send_prefetch();
+    _stop_stats_sampler();
     ctrl->Stop();
     std::vector<uint8_t> state = ctrl->GetPersistentState();
     delete ctrl;
-    clear_play_queue();
-    clear_hold_queue();
-    unset_output_file();
+    output_sink.reset();
     if (!persistent_state_file.empty()) {
         FILE *f = fopen(persistent_state_file.c_str(), "w");
         if (f) {
@@ -188,6 +393,141 @@ Stats VoIPController::get_stats() {
     };
 }
 
+QualityStats VoIPController::get_quality_stats() {
+    tgvoip::VoIPController::TrafficStats traffic {};
+    ctrl->GetStats(&traffic);
+    QualityStats stats {
+        ctrl->GetConnectionState(),
+        ctrl->GetSignalBarsCount(),
+        ctrl->GetAverageRTT(),
+        ctrl->GetPreferredRelayID(),
+        ctrl->GetLastError(),
+        traffic.bytesSentWifi + traffic.bytesSentMobile,
+        traffic.bytesRecvdWifi + traffic.bytesRecvdMobile,
+        0,
+        0,
+    };
+    // bitrates come from the sampler ring, so they don't depend on how often or from where this is called
+    std::lock_guard<std::mutex> lock(history_mutex);
+    if (history_size >= 2) {
+        const StatsSample &last = history[(history_head + history.size() - 1) % history.size()];
+        const StatsSample &prev = history[(history_head + history.size() - 2) % history.size()];
+        if (last.time > prev.time) {
+            stats.send_bitrate = 8 * (last.bytes_sent - prev.bytes_sent) / (last.time - prev.time);
+            stats.recv_bitrate = 8 * (last.bytes_recvd - prev.bytes_recvd) / (last.time - prev.time);
+        }
+    }
+    return stats;
+}
+
+py::dict VoIPController::get_stats_snapshot() {
+    std::vector<ControllerSnapshot> rows;
+    {
+        // libtgvoip getters take its own locks, so counters are copied without the GIL
+        py::gil_scoped_release release;
+        std::lock_guard<std::mutex> lock(registry_mutex);
+        rows.reserve(registry.size());
+        for (VoIPController *controller : registry) {
+            tgvoip::VoIPController::TrafficStats traffic {};
+            controller->ctrl->GetStats(&traffic);
+            rows.push_back(ControllerSnapshot {
+                controller->call_id,
+                controller->ctrl->GetConnectionState(),
+                controller->ctrl->GetSignalBarsCount(),
+                traffic.bytesSentWifi,
+                traffic.bytesSentMobile,
+                traffic.bytesRecvdWifi,
+                traffic.bytesRecvdMobile,
+            });
+        }
+    }
+    py::dict columns;
+    columns["call_id"] = column_memoryview(rows, &ControllerSnapshot::call_id, "q");
+    columns["state"] = column_memoryview(rows, &ControllerSnapshot::state, "i");
+    columns["signal_bars"] = column_memoryview(rows, &ControllerSnapshot::signal_bars, "i");
+    columns["bytes_sent_wifi"] = column_memoryview(rows, &ControllerSnapshot::bytes_sent_wifi, "Q");
+    columns["bytes_sent_mobile"] = column_memoryview(rows, &ControllerSnapshot::bytes_sent_mobile, "Q");
+    columns["bytes_recvd_wifi"] = column_memoryview(rows, &ControllerSnapshot::bytes_recvd_wifi, "Q");
+    columns["bytes_recvd_mobile"] = column_memoryview(rows, &ControllerSnapshot::bytes_recvd_mobile, "Q");
+    return columns;
+}
+
+void VoIPController::set_stats_sampling(unsigned int interval, size_t capacity) {
+    py::gil_scoped_release release;
+    _stop_stats_sampler();
+    {
+        std::lock_guard<std::mutex> lock(history_mutex);
+        history.assign(interval ? capacity : 0, StatsSample {});
+        history_head = 0;
+        history_size = 0;
+    }
+    if (interval == 0 || capacity == 0)
+        return;
+    std::lock_guard<std::mutex> lock(sampler_mutex);
+    sampler_running = true;
+    sampler_thread = std::thread(&VoIPController::_run_stats_sampler, this, std::chrono::milliseconds(interval));
+}
+
+void VoIPController::_run_stats_sampler(std::chrono::milliseconds interval) {
+    // samples are scheduled at fixed points in time, so the series does not drift when sampling is delayed
+    auto next = std::chrono::steady_clock::now();
+    std::unique_lock<std::mutex> lock(sampler_mutex);
+    while (sampler_running) {
+        lock.unlock();
+        _sample_stats();
+        lock.lock();
+        next += interval;
+        sampler_cv.wait_until(lock, next, [this] { return !sampler_running; });
+    }
+}
+
+void VoIPController::_stop_stats_sampler() {
+    {
+        std::lock_guard<std::mutex> lock(sampler_mutex);
+        if (!sampler_thread.joinable())
+            return;
+        sampler_running = false;
+    }
+    sampler_cv.notify_all();
+    sampler_thread.join();
+}
+
+void VoIPController::_sample_stats() {
+    tgvoip::VoIPController::TrafficStats traffic {};
+    ctrl->GetStats(&traffic);
+    StatsSample sample {
+        tgvoip::VoIPController::GetCurrentTime(),
+        traffic.bytesSentWifi + traffic.bytesSentMobile,
+        traffic.bytesRecvdWifi + traffic.bytesRecvdMobile,
+        ctrl->GetAverageRTT(),
+        ctrl->GetSignalBarsCount(),
+        ctrl->GetConnectionState(),
+    };
+    std::lock_guard<std::mutex> lock(history_mutex);
+    history[history_head] = sample;
+    history_head = (history_head + 1) % history.size();
+    history_size = std::min(history_size + 1, history.size());
+}
+
+py::dict VoIPController::get_stats_history() {
+    std::vector<StatsSample> samples;
+    {
+        std::lock_guard<std::mutex> lock(history_mutex);
+        samples.reserve(history_size);
+        size_t start = (history_head + history.size() - history_size) % std::max(history.size(), size_t(1));
+        for (size_t i = 0; i < history_size; ++i)
+            samples.push_back(history[(start + i) % history.size()]);
+    }
+    py::dict columns;
+    columns["time"] = column_memoryview(samples, &StatsSample::time, "d");
+    columns["bytes_sent"] = column_memoryview(samples, &StatsSample::bytes_sent, "Q");
+    columns["bytes_recvd"] = column_memoryview(samples, &StatsSample::bytes_recvd, "Q");
+    columns["rtt"] = column_memoryview(samples, &StatsSample::rtt, "d");
+    columns["signal_bars"] = column_memoryview(samples, &StatsSample::signal_bars, "i");
+    columns["state"] = column_memoryview(samples, &StatsSample::state, "i");
+    return columns;
+}
+
 std::string VoIPController::get_debug_log() {
     return ctrl->GetDebugLog();
 }
@@ -232,6 +572,199 @@ std::string VoIPController::get_current_audio_output_id() {
     return ctrl->GetCurrentAudioOutputID();
 } */
 
+void VoIPController::_on_state_change(int state) {
+    {
+        std::lock_guard<std::mutex> lock(state_mutex);
+        current_state = state;
+    }
+    state_cv.notify_all();
+    if (event_dispatch == EVENT_DISPATCH_SYNC) {
+        this->_handle_state_change(CallState(state));
+        _notify();
+    } else {
+        _queue_event(CallEvent::STATE_CHANGE, state);
+    }
+}
+
+void VoIPController::_on_signal_bars_change(int count) {
+    if (event_dispatch == EVENT_DISPATCH_SYNC)
+        this->_handle_signal_bars_change(count);
+    else
+        _queue_event(CallEvent::SIGNAL_BARS_CHANGE, count);
+}
+
+void VoIPController::_on_voice_activity_change(bool active) {
+    // called on the receive audio thread which must never wait for the GIL, so the event is never dispatched in
+    // place, without a dispatcher thread or an attached event loop the interpreter dispatches it on the main thread
+    bool queued;
+    {
+        tgvoip::MutexGuard notify_lock(notify_mutex);
+        EventDispatch mode = event_dispatch;
+        queued = mode == EVENT_DISPATCH_THREAD || (mode == EVENT_DISPATCH_LOOP && notify_fd != -1);
+        std::lock_guard<std::mutex> lock(event_mutex);
+        if (queued) {
+            events.push_back(CallEvent {CallEvent::VOICE_ACTIVITY_CHANGE, active});
+        } else {
+            pending_events.push_back(CallEvent {CallEvent::VOICE_ACTIVITY_CHANGE, active});
+            if (!pending_events_scheduled)
+                pending_events_scheduled = Py_AddPendingCall(_run_pending_events, this) == 0;
+        }
+    }
+    if (queued) {
+        event_cv.notify_one();
+        _notify();
+    }
+}
+
+int VoIPController::_run_pending_events(void *controller) {
+    auto *self = static_cast<VoIPController *>(controller);
+    {
+        // controller might have been destroyed since the call was scheduled
+        std::lock_guard<std::mutex> lock(registry_mutex);
+        if (!registry.count(self))
+            return 0;
+    }
+    // handlers might drop the last reference to the controller otherwise
+    py::object ref = py::cast(self, py::return_value_policy::reference);
+    self->_dispatch_pending_events();
+    return 0;
+}
+
+void VoIPController::_dispatch_pending_events() {
+    std::deque<CallEvent> dispatched;
+    {
+        std::lock_guard<std::mutex> lock(event_mutex);
+        std::swap(dispatched, pending_events);
+        pending_events_scheduled = false;
+    }
+    for (auto &event : dispatched)
+        _dispatch_event(event);
+}
+
+void VoIPController::_queue_event(CallEvent::Type type, int value) {
+    bool detached;
+    {
+        // checked together with pushing so that events queued before the notifier detaches are still polled by it
+        tgvoip::MutexGuard notify_lock(notify_mutex);
+        detached = event_dispatch == EVENT_DISPATCH_LOOP && notify_fd == -1;
+        if (!detached) {
+            std::lock_guard<std::mutex> lock(event_mutex);
+            events.push_back(CallEvent {type, value});
+        }
+    }
+    if (detached) {
+        // no event loop would ever poll the queue, dispatch in place instead of letting it grow
+        _dispatch_event(CallEvent {type, value});
+        return;
+    }
+    event_cv.notify_one();
+    _notify();
+}
+
+void VoIPController::_dispatch_event(const CallEvent &event) {
+    TimedGilAcquire gil(gil_timing);
+    try {
+        if (event.type == CallEvent::STATE_CHANGE)
+            this->_handle_state_change(CallState(event.value));
+        else if (event.type == CallEvent::SIGNAL_BARS_CHANGE)
+            this->_handle_signal_bars_change(event.value);
+        else
+            this->_handle_voice_activity_change(event.value != 0);
+    } catch (py::error_already_set &e) {
+        // keep the dispatcher alive, report like an unhandled exception in a thread
+        e.restore();
+        PyErr_Print();
+    }
+}
+
+void VoIPController::_run_event_dispatcher() {
+    std::unique_lock<std::mutex> lock(event_mutex);
+    while (true) {
+        event_cv.wait(lock, [this] { return !event_thread_running || !events.empty(); });
+        if (events.empty())
+            break;
+        CallEvent event = events.front();
+        events.pop_front();
+        lock.unlock();
+        _dispatch_event(event);
+        lock.lock();
+    }
+}
+
+void VoIPController::_stop_event_dispatcher() {
+    {
+        std::lock_guard<std::mutex> lock(event_mutex);
+        if (!event_thread.joinable())
+            return;
+        event_thread_running = false;
+    }
+    event_cv.notify_all();
+    if (PyGILState_Check()) {
+        // dispatcher might be waiting for the GIL
+        py::gil_scoped_release release;
+        event_thread.join();
+    } else {
+        event_thread.join();
+    }
+}
+
+void VoIPController::set_event_dispatch(EventDispatch mode) {
+    _stop_event_dispatcher();
+    event_dispatch = mode;
+    if (mode == EVENT_DISPATCH_THREAD) {
+        std::lock_guard<std::mutex> lock(event_mutex);
+        event_thread_running = true;
+        event_thread = std::thread(&VoIPController::_run_event_dispatcher, this);
+    }
+}
+
+EventDispatch VoIPController::get_event_dispatch() {
+    return event_dispatch;
+}
+
+int VoIPController::_get_state() {
+    std::lock_guard<std::mutex> lock(state_mutex);
+    return current_state;
+}
+
+bool VoIPController::wait_for_state(CallState state, double timeout) {
+    auto reached = [this, state] { return current_state == state || current_state == STATE_FAILED || finished; };
+    auto start = std::chrono::steady_clock::now();
+    while (true) {
+        // woken periodically so that signal handlers (KeyboardInterrupt) can run
+        double step = 0.1;
+        if (timeout >= 0) {
+            std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+            step = std::min(step, timeout - elapsed.count());
+        }
+        {
+            py::gil_scoped_release release;
+            std::unique_lock<std::mutex> lock(state_mutex);
+            if (state_cv.wait_for(lock, std::chrono::duration<double>(std::max(step, 0.0)), reached) || step < 0.1)
+                return current_state == state;
+        }
+        if (PyErr_CheckSignals() != 0)
+            throw py::error_already_set();
+    }
+}
+
+void VoIPController::_set_finished() {
+    {
+        std::lock_guard<std::mutex> lock(state_mutex);
+        finished = true;
+    }
+    state_cv.notify_all();
+}
+
+std::vector<std::pair<int, int>> VoIPController::_poll_events() {
+    std::vector<std::pair<int, int>> result;
+    std::lock_guard<std::mutex> lock(event_mutex);
+    for (auto &event : events)
+        result.emplace_back(event.type, event.value);
+    events.clear();
+    return result;
+}
+
 void VoIPController::_handle_state_change(CallState state) {
     throw py::not_implemented_error();
 }
@@ -240,67 +773,200 @@ void VoIPController::_handle_signal_bars_change(int count) {
     throw py::not_implemented_error();
 }
 
+void VoIPController::_handle_voice_activity_change(bool active) {
+    throw py::not_implemented_error();
+}
+
 void VoIPController::send_audio_frame(int16_t *buf, size_t size) {
+    auto start = std::chrono::steady_clock::now();
     tgvoip::MutexGuard m(input_mutex);
-    // auto start = std::chrono::high_resolution_clock::now();
     if (native_io) {
         this->_send_audio_frame_native_impl(buf, size);
+    } else if (buffered_io) {
+        this->_send_audio_frame_buffered_impl(buf, size);
+    } else if (send_prefetch) {
+        this->_send_audio_frame_prefetched_impl(buf, size);
+    } else {
+        this->_send_audio_frame_callback_impl(buf, size);
+    }
+    send_levels.process(buf, size);
+    {
+        tgvoip::MutexGuard rm(recording_mutex);
+        if (output_sink)
+            output_sink->write_outgoing(buf, size);
+    }
+    send_timing.record(start, size);
+}
+
+void VoIPController::_send_audio_frame_callback_impl(int16_t *buf, size_t size) {
+    size_t batch_size = send_batch_size;
+    if (batch_size <= size && send_batch_pos >= send_batch.size()) {
+        this->_fill_audio_frame(buf, size);
+        return;
+    }
+    size_t filled = 0;
+    while (filled < size) {
+        if (send_batch_pos >= send_batch.size()) {
+            // request next chunk ahead of time, following frames are served from it
+            send_batch.resize(std::max(batch_size, size - filled));
+            send_batch_pos = 0;
+            this->_fill_audio_frame(send_batch.data(), send_batch.size());
+        }
+        size_t count = std::min(size - filled, send_batch.size() - send_batch_pos);
+        memcpy(buf + filled, send_batch.data() + send_batch_pos, sizeof(int16_t) * count);
+        send_batch_pos += count;
+        filled += count;
+    }
+}
+
+void VoIPController::_fill_audio_frame(int16_t *buf, size_t size) {
+    // buffers are reused between frames (batch, prefetch), callbacks which write nothing must produce silence
+    std::fill(buf, buf + size, 0);
+    if (send_zero_copy || send_ndarray) {
+        TimedGilAcquire gil(gil_timing);
+        AudioFrameView frame(buf, size, false, send_ndarray, send_frame_copy);
+        this->_send_audio_frame_view_impl(frame.frame);
+        frame.release();
     } else {
         char *frame = this->_send_audio_frame_impl(sizeof(int16_t) * size);
         if (frame != nullptr) {
             memcpy(buf, frame, sizeof(int16_t) * size);
         }
     }
-    // auto finish = std::chrono::high_resolution_clock::now();
-    // std::cout << "send: " << std::chrono::duration_cast<std::chrono::nanoseconds>(finish - start).count() << std::endl;
 }
 
 char *VoIPController::_send_audio_frame_impl(unsigned long len) { return (char *)""; }
 
+void VoIPController::_send_audio_frame_view_impl(const py::buffer &frame) {}
+
 void VoIPController::_send_audio_frame_native_impl(int16_t *buf, size_t size) {
-    if (!input_files.empty()) {
-        size_t read_size = fread(buf, sizeof(int16_t), size, input_files.front());
+    // mixed sources are ducked while play queue is active
+    bool ducking = !input_sources.empty();
+    if (!input_sources.empty()) {
+        size_t read_size = input_sources.front()->read(buf, size);
         if (read_size != size) {
-            fclose(input_files.front());
-            input_files.pop();
-            size_t read_offset = read_size % size;
-            memset(buf + read_offset, 0, size - read_offset);
+            input_sources.pop();
+            memset(buf + read_size, 0, sizeof(int16_t) * (size - read_size));
         }
-    } else if (!hold_files.empty()) {
-        size_t read_size = fread(buf, sizeof(int16_t), size, hold_files.front());
+    } else if (!hold_sources.empty()) {
+        size_t read_size = hold_sources.front()->read(buf, size);
         if (read_size != size) {
-            fseek(hold_files.front(), 0, SEEK_SET);
-            hold_files.push(hold_files.front());
-            hold_files.pop();
-            size_t read_offset = read_size % size;
-            memset(buf + read_offset, 0, size - read_offset);
+            hold_sources.front()->rewind();
+            hold_sources.push(std::move(hold_sources.front()));
+            hold_sources.pop();
+            memset(buf + read_size, 0, sizeof(int16_t) * (size - read_size));
         }
     }
+    mixer.mix(buf, size, ducking);
+}
+
+void VoIPController::_send_audio_frame_prefetched_impl(int16_t *buf, size_t size) {
+    if (prefetch_frame_size == 0) {
+        // helper doesn't write until the frame size is published, so the buffer can be sized here
+        prefetch_size = prefetch_frames * size;
+        prefetch_buffer.resize(prefetch_size);
+        prefetch_frame_size = size;
+    }
+    size_t read_size = prefetch_buffer.read(buf, size);
+    if (read_size != size) {
+        memset(buf + read_size, 0, sizeof(int16_t) * (size - read_size));
+        ++send_underruns;
+    }
+    prefetch_cv.notify_one();
+}
+
+void VoIPController::_send_audio_frame_buffered_impl(int16_t *buf, size_t size) {
+    size_t read_size = send_buffer.read(buf, size);
+    if (read_size != size) {
+        memset(buf + read_size, 0, sizeof(int16_t) * (size - read_size));
+        ++send_underruns;
+    }
+    std::atomic_thread_fence(std::memory_order_seq_cst);
+    if (send_notify_armed && send_buffer.capacity() - send_buffer.size() >= send_notify_size
+            && send_notify_armed.exchange(false))
+        _notify();
 }
 
 void VoIPController::recv_audio_frame(int16_t *buf, size_t size) {
+    auto start = std::chrono::steady_clock::now();
     tgvoip::MutexGuard m(output_mutex);
-    // auto start = std::chrono::high_resolution_clock::now();
     if (buf != nullptr) {
+        recv_levels.process(buf, size);
+        bool voiced = true;
+        if (vad) {
+            bool was_voiced = vad->active();
+            voiced = vad->process(buf, size);
+            if (voiced != was_voiced)
+                _on_voice_activity_change(voiced);
+        }
         if (native_io) {
             this->_recv_audio_frame_native_impl(buf, size);
-        } else {
-            std::string frame((const char *) buf, sizeof(int16_t) * size);
-            this->_recv_audio_frame_impl(frame);
+        } else if (buffered_io) {
+            this->_recv_audio_frame_buffered_impl(buf, size);
+        } else if (voiced || !vad_gate) {
+            this->_recv_audio_frame_callback_impl(buf, size);
         }
+        tgvoip::MutexGuard rm(recording_mutex);
+        if (output_sink)
+            output_sink->write(buf, size);
+    }
+    recv_timing.record(start, size);
+}
+
+void VoIPController::_recv_audio_frame_callback_impl(int16_t *buf, size_t size) {
+    size_t batch_size = recv_batch_size;
+    if (batch_size <= size && recv_batch.empty()) {
+        this->_deliver_audio_frame(buf, size);
+        return;
+    }
+    if (recv_batch.capacity() < batch_size)
+        recv_batch.reserve(batch_size);
+    recv_batch.insert(recv_batch.end(), buf, buf + size);
+    if (recv_batch.size() >= batch_size) {
+        this->_deliver_audio_frame(recv_batch.data(), recv_batch.size());
+        recv_batch.clear();
+    }
+}
+
+void VoIPController::_deliver_audio_frame(int16_t *buf, size_t size) {
+    TimedGilAcquire gil(gil_timing);
+    if (recv_zero_copy || recv_ndarray) {
+        AudioFrameView frame(buf, size, true, recv_ndarray, recv_frame_copy);
+        this->_recv_audio_frame_view_impl(frame.frame);
+        frame.release();
+    } else {
+        this->_recv_audio_frame_impl(py::bytes((const char *) buf, sizeof(int16_t) * size));
     }
-    // auto finish = std::chrono::high_resolution_clock::now();
-    // std::cout << "recv: " << std::chrono::duration_cast<std::chrono::nanoseconds>(finish - start).count() << std::endl;
 }
 
 void VoIPController::_recv_audio_frame_impl(const py::bytes &frame) {}
 
+void VoIPController::_recv_audio_frame_view_impl(const py::buffer &frame) {}
+
 void VoIPController::_recv_audio_frame_native_impl(int16_t *buf, size_t size) {
-    if (output_file != nullptr) {
-        size_t written_size = fwrite(buf, sizeof(int16_t), size, output_file);
-        if (written_size != size) {
-            std::cerr << "Written size (" << written_size << ") does not match expected (" << size << ")" << std::endl;
-        }
+    // output file is written for every I/O mode in recv_audio_frame
+    if (output_fd_sink && !output_fd_sink->write(buf, size))
+        output_fd_sink.reset();
+}
+
+void VoIPController::_recv_audio_frame_buffered_impl(int16_t *buf, size_t size) {
+    if (recv_buffer.write(buf, size) != size)
+        ++recv_overruns;
+    std::atomic_thread_fence(std::memory_order_seq_cst);
+    if (recv_notify_armed && recv_buffer.size() >= recv_notify_size && recv_notify_armed.exchange(false))
+        _notify();
+}
+
+void VoIPController::_notify() {
+    tgvoip::MutexGuard m(notify_mutex);
+    if (notify_fd != -1) {
+        // socket is non-blocking, a full socket buffer already guarantees a wakeup
+        char byte = 0;
+#ifdef _WIN32
+        send((SOCKET) notify_fd, &byte, 1, 0);
+#else
+        send((int) notify_fd, &byte, 1, 0);
+#endif
     }
 }
 
@@ -320,64 +986,377 @@ void VoIPController::_native_io_set(bool status) {
     native_io = status;
 }
 
-bool VoIPController::play(std::string &path) {
-    FILE *tmp = fopen(path.c_str(), "rb");
-    if (tmp == nullptr) {
+void VoIPController::_send_zero_copy_set(bool status) {
+    send_zero_copy = status;
+}
+
+void VoIPController::_recv_zero_copy_set(bool status) {
+    recv_zero_copy = status;
+}
+
+void VoIPController::_send_ndarray_set(bool status) {
+    send_ndarray = status;
+}
+
+void VoIPController::_recv_ndarray_set(bool status) {
+    recv_ndarray = status;
+}
+
+bool VoIPController::_buffered_io_get() {
+    return buffered_io;
+}
+
+void VoIPController::_buffered_io_set(bool status) {
+    buffered_io = status;
+}
+
+void VoIPController::set_audio_buffer_size(size_t send_size, size_t recv_size) {
+    // audio threads may be waiting for the GIL while holding these mutexes, so they are taken without it
+    std::unique_ptr<py::gil_scoped_release> release(new py::gil_scoped_release);
+    tgvoip::MutexGuard im(input_mutex);
+    tgvoip::MutexGuard om(output_mutex);
+    // write_audio() and read_audio() are only serialized by the GIL, buffered audio threads never take it
+    release.reset();
+    send_buffer.resize(send_size / sizeof(int16_t));
+    recv_buffer.resize(recv_size / sizeof(int16_t));
+}
+
+void VoIPController::set_callback_batching(unsigned int send_duration, unsigned int recv_duration) {
+    // 48 kHz mono, frames are 20 ms long
+    send_batch_size = 48 * send_duration;
+    recv_batch_size = 48 * recv_duration;
+    _flush_recv_batch();
+}
+
+void VoIPController::_flush_recv_batch() {
+    // audio threads may be waiting for the GIL while holding output_mutex, so it's taken without it
+    std::unique_ptr<py::gil_scoped_release> release(new py::gil_scoped_release);
+    tgvoip::MutexGuard m(output_mutex);
+    // delivered before any later frame, which can only be batched or delivered under output_mutex
+    release.reset();
+    std::vector<int16_t> batch;
+    std::swap(batch, recv_batch);
+    if (!batch.empty())
+        this->_deliver_audio_frame(batch.data(), batch.size());
+}
+
+void VoIPController::set_send_prefetch(unsigned int frames) {
+    // audio thread must not call the send callback while the helper thread is running
+    py::gil_scoped_release release;
+    tgvoip::MutexGuard m(input_mutex);
+    send_prefetch = false;
+    _stop_send_prefetch();
+    if (frames == 0)
+        return;
+    // buffer is sized by the audio thread once libtgvoip's frame size is known
+    prefetch_frames = frames;
+    prefetch_frame_size = 0;
+    {
+        std::lock_guard<std::mutex> lock(prefetch_mutex);
+        prefetch_running = true;
+        prefetch_thread = std::thread(&VoIPController::_run_send_prefetch, this);
+    }
+    send_prefetch = true;
+}
+
+void VoIPController::_run_send_prefetch() {
+    std::vector<int16_t> frame;
+    std::unique_lock<std::mutex> lock(prefetch_mutex);
+    while (prefetch_running) {
+        size_t frame_size = prefetch_frame_size;
+        if (frame_size == 0 || prefetch_size - prefetch_buffer.size() < frame_size) {
+            // audio thread notifies without locking, so a wakeup might be missed, timeout bounds the delay
+            prefetch_cv.wait_for(lock, std::chrono::milliseconds(20));
+            continue;
+        }
+        lock.unlock();
+        frame.resize(frame_size);
+        this->_send_audio_frame_callback_impl(frame.data(), frame.size());
+        prefetch_buffer.write(frame.data(), frame.size());
+        lock.lock();
+    }
+}
+
+void VoIPController::_stop_send_prefetch() {
+    {
+        std::lock_guard<std::mutex> lock(prefetch_mutex);
+        if (!prefetch_thread.joinable())
+            return;
+        prefetch_running = false;
+    }
+    prefetch_cv.notify_all();
+    if (PyGILState_Check()) {
+        // helper might be waiting for the GIL
+        py::gil_scoped_release release;
+        prefetch_thread.join();
+    } else {
+        prefetch_thread.join();
+    }
+}
+
+size_t VoIPController::write_audio(const py::buffer &data) {
+    py::buffer_info info = data.request();
+    py::ssize_t stride = info.itemsize;
+    for (py::ssize_t i = info.ndim - 1; i >= 0; --i) {
+        if (info.shape[i] != 1 && info.strides[i] != stride)
+            throw py::value_error("audio data must be a C-contiguous buffer");
+        stride *= info.shape[i];
+    }
+    size_t length = static_cast<size_t>(info.size * info.itemsize) / sizeof(int16_t);
+    size_t written = send_buffer.write(static_cast<const int16_t *>(info.ptr), length);
+    if (written != length)
+        ++send_overruns;
+    return sizeof(int16_t) * written;
+}
+
+py::bytes VoIPController::read_audio(long max_length) {
+    size_t length = recv_buffer.size();
+    if (max_length >= 0)
+        length = std::min(length, static_cast<size_t>(max_length) / sizeof(int16_t));
+    PyObject *frame = PyBytes_FromStringAndSize(nullptr, static_cast<Py_ssize_t>(sizeof(int16_t) * length));
+    if (frame == nullptr)
+        throw py::error_already_set();
+    recv_buffer.read(reinterpret_cast<int16_t *>(PyBytes_AS_STRING(frame)), length);
+    return py::reinterpret_steal<py::bytes>(frame);
+}
+
+void VoIPController::_set_notify_fd(intptr_t fd) {
+    tgvoip::MutexGuard m(notify_mutex);
+    notify_fd = fd;
+}
+
+bool VoIPController::_wait_recv_audio(size_t length) {
+    recv_notify_size = std::min(length / sizeof(int16_t), recv_buffer.capacity());
+    recv_notify_armed = true;
+    std::atomic_thread_fence(std::memory_order_seq_cst);
+    if (recv_buffer.size() >= recv_notify_size) {
+        recv_notify_armed = false;
+        return true;
+    }
+    return false;
+}
+
+bool VoIPController::_wait_send_audio(size_t length) {
+    send_notify_size = std::min(length / sizeof(int16_t), send_buffer.capacity());
+    send_notify_armed = true;
+    std::atomic_thread_fence(std::memory_order_seq_cst);
+    if (send_buffer.capacity() - send_buffer.size() >= send_notify_size) {
+        send_notify_armed = false;
+        return true;
+    }
+    return false;
+}
+
+BufferStats VoIPController::get_buffer_stats() {
+    return BufferStats {
+        sizeof(int16_t) * send_buffer.size(),
+        sizeof(int16_t) * send_buffer.capacity(),
+        sizeof(int16_t) * recv_buffer.size(),
+        sizeof(int16_t) * recv_buffer.capacity(),
+        send_underruns,
+        send_overruns,
+        recv_overruns,
+    };
+}
+
+AudioTimingStats VoIPController::get_audio_timing_stats() {
+    return AudioTimingStats {
+        send_timing.duration.get_stats(),
+        send_timing.interval.get_stats(),
+        send_timing.late,
+        recv_timing.duration.get_stats(),
+        recv_timing.interval.get_stats(),
+        recv_timing.late,
+    };
+}
+
+void VoIPController::reset_audio_timing_stats() {
+    send_timing.reset();
+    recv_timing.reset();
+}
+
+GilStats VoIPController::get_gil_stats() {
+    return gil_timing.get_stats();
+}
+
+void VoIPController::reset_gil_stats() {
+    gil_timing.reset();
+}
+
+GilStats VoIPController::get_process_gil_stats() {
+    return GilTiming::process().get_stats();
+}
+
+void VoIPController::reset_process_gil_stats() {
+    GilTiming::process().reset();
+}
+
+AudioLevels VoIPController::get_audio_levels() {
+    return AudioLevels {
+        send_levels.take_rms(),
+        send_levels.take_peak(),
+        send_levels.clipped(),
+        recv_levels.take_rms(),
+        recv_levels.take_peak(),
+        recv_levels.clipped(),
+    };
+}
+
+bool VoIPController::play(std::string &path, bool preload) {
+    // mapping (and preloading) might take a while, audio thread might also wait for the GIL holding input_mutex
+    py::gil_scoped_release release;
+    std::unique_ptr<AudioSource> source = open_audio_source(path, preload);
+    if (!source) {
         std::cerr << "Unable to open file " << path << " for reading" << std::endl;
         return false;
     }
     tgvoip::MutexGuard m(input_mutex);
-    input_files.push(tmp);
+    input_sources.push(std::move(source));
     return true;
 }
 
-void VoIPController::play_on_hold(std::vector<std::string> &paths) {
-    clear_hold_queue();
+void VoIPController::play_buffer(const py::buffer &data) {
+    std::unique_ptr<AudioSource> source(new PyBufferSource(data));
+    py::gil_scoped_release release;
     tgvoip::MutexGuard m(input_mutex);
+    input_sources.push(std::move(source));
+}
+
+void VoIPController::play_on_hold(std::vector<std::string> &paths, bool preload) {
+    py::gil_scoped_release release;
+    std::queue<std::unique_ptr<AudioSource>> sources;
     for (auto &path : paths) {
-        FILE *tmp = fopen(path.c_str(), "rb");
-        if (tmp == nullptr) {
+        std::unique_ptr<AudioSource> source = open_audio_source(path, preload);
+        if (!source) {
             std::cerr << "Unable to open file " << path << " for reading" << std::endl;
         } else {
-            hold_files.push(tmp);
+            sources.push(std::move(source));
         }
     }
+    // previous sources are unmapped after the mutex is unlocked
+    tgvoip::MutexGuard m(input_mutex);
+    std::swap(hold_sources, sources);
 }
 
-bool VoIPController::set_output_file(std::string &path) {
-    FILE *tmp = fopen(path.c_str(), "wb");
-    if (tmp == nullptr) {
+bool VoIPController::set_output_file(std::string &path, AudioEncoding encoding, int bitrate, RecordingMode mode,
+                                     unsigned int queue_duration, unsigned int flush_interval) {
+    py::gil_scoped_release release;
+    unsigned int channels = mode == RECORDING_MODE_STEREO ? 2 : 1;
+    std::unique_ptr<AudioSink> file_sink = open_audio_sink(path, encoding, bitrate, channels);
+    if (!file_sink) {
         std::cerr << "Unable to open file " << path << " for writing" << std::endl;
         return false;
     }
-    unset_output_file();
-    tgvoip::MutexGuard m(output_mutex);
-    output_file = tmp;
+    // 48 kHz mono
+    std::unique_ptr<AsyncAudioSink> sink(new AsyncAudioSink(std::move(file_sink), mode, 48 * queue_duration,
+                                                            flush_interval));
+    // previous sink is finalized after the mutex is unlocked
+    tgvoip::MutexGuard m(recording_mutex);
+    std::swap(output_sink, sink);
     return true;
 }
 
+int VoIPController::add_mix_source(std::string &path, float gain, float duck_gain, bool loop, bool preload) {
+    py::gil_scoped_release release;
+    std::unique_ptr<AudioSource> source = open_audio_source(path, preload);
+    if (!source) {
+        std::cerr << "Unable to open file " << path << " for reading" << std::endl;
+        return -1;
+    }
+    tgvoip::MutexGuard m(input_mutex);
+    return mixer.add(std::move(source), gain, duck_gain, loop);
+}
+
+bool VoIPController::remove_mix_source(int id) {
+    py::gil_scoped_release release;
+    std::unique_ptr<AudioSource> source;
+    tgvoip::MutexGuard m(input_mutex);
+    source = mixer.remove(id);
+    return source != nullptr;
+}
+
+bool VoIPController::set_mix_source_gain(int id, float gain, float duck_gain) {
+    py::gil_scoped_release release;
+    tgvoip::MutexGuard m(input_mutex);
+    return mixer.set_gain(id, gain, duck_gain);
+}
+
+void VoIPController::clear_mix_sources() {
+    py::gil_scoped_release release;
+    std::vector<std::unique_ptr<AudioSource>> sources;
+    tgvoip::MutexGuard m(input_mutex);
+    sources = mixer.clear();
+}
+
 void VoIPController::clear_play_queue() {
+    py::gil_scoped_release release;
+    std::queue<std::unique_ptr<AudioSource>> sources;
     tgvoip::MutexGuard m(input_mutex);
-    while (!input_files.empty()) {
-        fclose(input_files.front());
-        input_files.pop();
-    }
+    std::swap(input_sources, sources);
 }
 
 void VoIPController::clear_hold_queue() {
+    py::gil_scoped_release release;
+    std::queue<std::unique_ptr<AudioSource>> sources;
     tgvoip::MutexGuard m(input_mutex);
-    while (!hold_files.empty()) {
-        fclose(hold_files.front());
-        hold_files.pop();
-    }
+    std::swap(hold_sources, sources);
 }
 
 void VoIPController::unset_output_file() {
-    if (output_file != nullptr) {
-        tgvoip::MutexGuard m(output_mutex);
-        fclose(output_file);
-        output_file = nullptr;
+    py::gil_scoped_release release;
+    std::unique_ptr<AsyncAudioSink> sink;
+    tgvoip::MutexGuard m(recording_mutex);
+    std::swap(output_sink, sink);
+}
+
+bool VoIPController::play_fd(int fd, unsigned int jitter_buffer) {
+    py::gil_scoped_release release;
+    // 48 kHz mono
+    std::unique_ptr<AudioSource> source = FdAudioSource::open(fd, 48 * jitter_buffer);
+    if (!source) {
+        std::cerr << "Unable to read audio from file descriptor " << fd << std::endl;
+        return false;
     }
+    tgvoip::MutexGuard m(input_mutex);
+    input_sources.push(std::move(source));
+    return true;
+}
+
+bool VoIPController::set_output_fd(int fd, unsigned int buffer_duration) {
+    py::gil_scoped_release release;
+    std::unique_ptr<AudioSink> sink = FdAudioSink::open(fd, 48 * buffer_duration);
+    if (!sink) {
+        std::cerr << "Unable to write audio to file descriptor " << fd << std::endl;
+        return false;
+    }
+    tgvoip::MutexGuard m(output_mutex);
+    std::swap(output_fd_sink, sink);
+    return true;
+}
+
+void VoIPController::unset_output_fd() {
+    py::gil_scoped_release release;
+    std::unique_ptr<AudioSink> sink;
+    tgvoip::MutexGuard m(output_mutex);
+    std::swap(output_fd_sink, sink);
+}
+
+void VoIPController::set_voice_activity_detection(bool enabled, int aggressiveness, unsigned int hangover,
+                                                  bool gate_callback) {
+    std::unique_ptr<VoiceActivityDetector> detector;
+    if (enabled)
+        detector.reset(new VoiceActivityDetector(aggressiveness, hangover));
+    py::gil_scoped_release release;
+    tgvoip::MutexGuard m(output_mutex);
+    std::swap(vad, detector);
+    vad_gate = enabled && gate_callback;
+}
+
+RecordingStats VoIPController::get_recording_stats() {
+    tgvoip::MutexGuard m(recording_mutex);
+    if (!output_sink)
+        return RecordingStats {0, 0, 0, 0, 0, 0, 0.0};
+    return output_sink->get_stats();
 }
 
 void VoIPServerConfig::set_config(std::string &json_str) {
@@ -22,12 +22,19 @@
 #ifndef PYLIBTGVOIP_LIBRARY_H
 #define PYLIBTGVOIP_LIBRARY_H
 
+#include <atomic>
+#include <condition_variable>
+#include <deque>
 #include <iostream>
+#include <mutex>
 #include <queue>
+#include <thread>
+#include <unordered_set>
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
 #include <VoIPController.h>
 #include <VoIPServerConfig.h>
+#include "_tgvoip_audio.h"
 
 namespace pybind11 {
     class not_implemented_error : public std::exception {};
@@ -72,6 +79,12 @@ enum CallError {
     ERROR_PROXY = tgvoip::ERROR_PROXY,
 };
 
+enum EventDispatch {
+    EVENT_DISPATCH_SYNC,
+    EVENT_DISPATCH_THREAD,
+    EVENT_DISPATCH_LOOP,
+};
+
 struct Stats {
     uint64_t bytes_sent_wifi;
     uint64_t bytes_sent_mobile;
@@ -79,6 +92,37 @@ struct Stats {
     uint64_t bytes_recvd_mobile;
 };
 
+struct QualityStats {
+    int state;
+    int signal_bars;
+    double rtt;  // seconds
+    int64_t preferred_relay_id;
+    int last_error;
+    uint64_t bytes_sent;
+    uint64_t bytes_recvd;
+    double send_bitrate;  // bits per second between the two latest stats samples, 0 without them
+    double recv_bitrate;
+};
+
+struct StatsSample {
+    double time;
+    uint64_t bytes_sent;
+    uint64_t bytes_recvd;
+    double rtt;
+    int32_t signal_bars;
+    int32_t state;
+};
+
+struct ControllerSnapshot {
+    int64_t call_id;
+    int32_t state;
+    int32_t signal_bars;
+    uint64_t bytes_sent_wifi;
+    uint64_t bytes_sent_mobile;
+    uint64_t bytes_recvd_wifi;
+    uint64_t bytes_recvd_mobile;
+};
+
 struct Endpoint {
     Endpoint(int64_t id, std::string ip, std::string ipv6, uint16_t port, const std::string &peer_tag);
     int64_t id;
@@ -88,6 +132,74 @@ struct Endpoint {
     py::bytes peer_tag;
 };
 
+struct CallEvent {
+    enum Type {
+        STATE_CHANGE,
+        SIGNAL_BARS_CHANGE,
+        VOICE_ACTIVITY_CHANGE,
+    } type;
+    int value;
+};
+
+struct BufferStats {
+    size_t send_buffered;
+    size_t send_capacity;
+    size_t recv_buffered;
+    size_t recv_capacity;
+    uint64_t send_underruns;
+    uint64_t send_overruns;
+    uint64_t recv_overruns;
+};
+
+struct AudioTimingStats {
+    LatencyStats send_duration;
+    LatencyStats send_interval;
+    uint64_t send_late;
+    LatencyStats recv_duration;
+    LatencyStats recv_interval;
+    uint64_t recv_late;
+};
+
+struct GilStats {
+    LatencyStats wait;
+    LatencyStats hold;
+};
+
+// time spent waiting for the GIL and holding it by native code calling into Python
+class GilTiming {
+public:
+    static GilTiming &process();
+    GilStats get_stats() const;
+    void reset();
+
+    LatencyHistogram wait;
+    LatencyHistogram hold;
+};
+
+// acquires the GIL recording wait and hold time both into given and process-wide timings,
+// nothing is recorded if the GIL is already held by the current thread
+class TimedGilAcquire {
+public:
+    explicit TimedGilAcquire(GilTiming &timing);
+    ~TimedGilAcquire();
+
+private:
+    GilTiming &timing;
+    bool nested;
+    std::chrono::steady_clock::time_point start;
+    py::gil_scoped_acquire gil;
+    std::chrono::steady_clock::time_point acquired;
+};
+
+struct AudioLevels {
+    float send_rms;
+    float send_peak;
+    uint64_t send_clipped;
+    float recv_rms;
+    float recv_peak;
+    uint64_t recv_clipped;
+};
+
 class VoIPController {
 public:
     VoIPController();
@@ -114,6 +226,10 @@ public:
     long get_preferred_relay_id();
     CallError get_last_error();
     Stats get_stats();
+    QualityStats get_quality_stats();
+    void set_stats_sampling(unsigned int interval, size_t capacity);
+    py::dict get_stats_history();
+    static py::dict get_stats_snapshot();
     std::string get_debug_log();
     void set_audio_output_gain_control_enabled(bool enabled);
     void set_echo_cancellation_strength(int strength);
@@ -130,53 +246,217 @@ public:
     // callbacks
     virtual void _handle_state_change(CallState state);
     virtual void _handle_signal_bars_change(int count);
+    virtual void _handle_voice_activity_change(bool active);
     void send_audio_frame(int16_t *buf, size_t size);
     void recv_audio_frame(int16_t *buf, size_t size);
     virtual char *_send_audio_frame_impl(unsigned long len);
+    virtual void _send_audio_frame_view_impl(const py::buffer &frame);
     virtual void _recv_audio_frame_impl(const py::bytes &frame);
+    virtual void _recv_audio_frame_view_impl(const py::buffer &frame);
 
     static std::string get_version(const py::object& /* cls */);
     static int connection_max_layer(const py::object& /* cls */);
 
     bool _native_io_get();
     void _native_io_set(bool status);
-    bool play(std::string &path);
-    void play_on_hold(std::vector<std::string> &path);
-    bool set_output_file(std::string &path);
+    void _send_zero_copy_set(bool status);
+    void _recv_zero_copy_set(bool status);
+    void _send_ndarray_set(bool status);
+    void _recv_ndarray_set(bool status);
+    bool _buffered_io_get();
+    void _buffered_io_set(bool status);
+    void set_audio_buffer_size(size_t send_size, size_t recv_size);
+    void set_callback_batching(unsigned int send_duration, unsigned int recv_duration);
+    void _flush_recv_batch();
+    void set_send_prefetch(unsigned int frames);
+    size_t write_audio(const py::buffer &data);
+    py::bytes read_audio(long max_length);
+    BufferStats get_buffer_stats();
+    AudioLevels get_audio_levels();
+    AudioTimingStats get_audio_timing_stats();
+    void reset_audio_timing_stats();
+    GilStats get_gil_stats();
+    void reset_gil_stats();
+    static GilStats get_process_gil_stats();
+    static void reset_process_gil_stats();
+    void _set_notify_fd(intptr_t fd);
+    bool _wait_recv_audio(size_t length);
+    bool _wait_send_audio(size_t length);
+    void set_event_dispatch(EventDispatch mode);
+    EventDispatch get_event_dispatch();
+    int _get_state();
+    bool wait_for_state(CallState state, double timeout);
+    void _set_finished();
+    std::vector<std::pair<int, int>> _poll_events();
+    bool play(std::string &path, bool preload);
+    void play_buffer(const py::buffer &data);
+    void play_on_hold(std::vector<std::string> &paths, bool preload);
+    bool set_output_file(std::string &path, AudioEncoding encoding, int bitrate, RecordingMode mode,
+                         unsigned int queue_duration, unsigned int flush_interval);
+    int add_mix_source(std::string &path, float gain, float duck_gain, bool loop, bool preload);
+    bool remove_mix_source(int id);
+    bool set_mix_source_gain(int id, float gain, float duck_gain);
+    void clear_mix_sources();
     void clear_play_queue();
     void clear_hold_queue();
     void unset_output_file();
+    bool play_fd(int fd, unsigned int jitter_buffer);
+    bool set_output_fd(int fd, unsigned int buffer_duration);
+    void unset_output_fd();
+    void set_voice_activity_detection(bool enabled, int aggressiveness, unsigned int hangover, bool gate_callback);
+    RecordingStats get_recording_stats();
     void _send_audio_frame_native_impl(int16_t *buf, size_t size);
     void _recv_audio_frame_native_impl(int16_t *buf, size_t size);
+    void _send_audio_frame_buffered_impl(int16_t *buf, size_t size);
+    void _recv_audio_frame_buffered_impl(int16_t *buf, size_t size);
+    void _send_audio_frame_callback_impl(int16_t *buf, size_t size);
+    void _recv_audio_frame_callback_impl(int16_t *buf, size_t size);
+    void _send_audio_frame_prefetched_impl(int16_t *buf, size_t size);
 
     std::string persistent_state_file;
+    int64_t call_id = 0;
+
+protected:
+    GilTiming gil_timing;
 
 private:
+    void _fill_audio_frame(int16_t *buf, size_t size);
+    void _deliver_audio_frame(int16_t *buf, size_t size);
+    void _notify();
+    void _on_state_change(int state);
+    void _on_signal_bars_change(int count);
+    void _on_voice_activity_change(bool active);
+    void _queue_event(CallEvent::Type type, int value);
+    void _dispatch_event(const CallEvent &event);
+    void _dispatch_pending_events();
+    static int _run_pending_events(void *controller);
+    void _run_event_dispatcher();
+    void _stop_event_dispatcher();
+    void _run_send_prefetch();
+    void _stop_send_prefetch();
+    void _run_stats_sampler(std::chrono::milliseconds interval);
+    void _stop_stats_sampler();
+    void _sample_stats();
+
+    // every initialized controller, guarded by registry_mutex
+    static std::mutex registry_mutex;
+    static std::unordered_set<VoIPController *> registry;
+
     tgvoip::VoIPController *ctrl{};
     tgvoip::Mutex output_mutex;
     tgvoip::Mutex input_mutex;
 
     bool native_io = false;
-    std::queue<FILE*> input_files;
-    std::queue<FILE*> hold_files;
-    FILE *output_file = nullptr;
+    std::atomic<bool> send_zero_copy{false};
+    std::atomic<bool> recv_zero_copy{false};
+    std::atomic<bool> send_ndarray{false};
+    std::atomic<bool> recv_ndarray{false};
+    std::atomic<bool> send_frame_copy{false};  // a send callback has kept a frame view
+    std::atomic<bool> recv_frame_copy{false};  // a receive callback has kept a frame view
+    std::queue<std::unique_ptr<AudioSource>> input_sources;
+    std::queue<std::unique_ptr<AudioSource>> hold_sources;
+    AudioMixer mixer;
+    // held only to pass frames to the output file queues, audio threads never wait for the GIL holding it
+    tgvoip::Mutex recording_mutex;
+    std::unique_ptr<AsyncAudioSink> output_sink;
+
+    std::atomic<bool> buffered_io{false};
+    AudioRingBuffer send_buffer;
+    AudioRingBuffer recv_buffer;
+    std::atomic<uint64_t> send_underruns{0};
+    std::atomic<uint64_t> send_overruns{0};
+    std::atomic<uint64_t> recv_overruns{0};
+
+    tgvoip::Mutex notify_mutex;
+    intptr_t notify_fd = -1;
+    std::atomic<bool> send_notify_armed{false};
+    std::atomic<size_t> send_notify_size{0};
+    std::atomic<bool> recv_notify_armed{false};
+    std::atomic<size_t> recv_notify_size{0};
+
+    std::mutex state_mutex;
+    std::condition_variable state_cv;
+    int current_state = 0;
+    bool finished = false;  // call has ended or controller is being destroyed, state waits are over
+    std::atomic<EventDispatch> event_dispatch{EVENT_DISPATCH_SYNC};
+    std::mutex event_mutex;
+    std::condition_variable event_cv;
+    std::deque<CallEvent> events;
+    std::deque<CallEvent> pending_events;  // dispatched by the interpreter, see _on_voice_activity_change()
+    bool pending_events_scheduled = false;
+    std::thread event_thread;
+    bool event_thread_running = false;
+
+    std::atomic<size_t> send_batch_size{0};
+    std::atomic<size_t> recv_batch_size{0};
+
+    // sampler thread appends to a fixed-size ring, oldest samples are overwritten
+    std::mutex sampler_mutex;
+    std::condition_variable sampler_cv;
+    std::thread sampler_thread;
+    bool sampler_running = false;
+    std::mutex history_mutex;
+    std::vector<StatsSample> history;
+    size_t history_head = 0;
+    size_t history_size = 0;
+
+    CallbackTiming send_timing;
+    CallbackTiming recv_timing;
+
+    AudioLevelMeter send_levels;
+    AudioLevelMeter recv_levels;
+
+    std::unique_ptr<AudioSink> output_fd_sink;  // guarded by output_mutex
+    std::unique_ptr<VoiceActivityDetector> vad;  // guarded by output_mutex
+    std::atomic<bool> vad_gate{false};
+    // helper thread calls the send callback ahead of time, audio thread only dequeues frames
+    std::atomic<bool> send_prefetch{false};
+    AudioRingBuffer prefetch_buffer;
+    unsigned int prefetch_frames = 0;  // guarded by input_mutex
+    // libtgvoip's frame size, set by the audio thread on the first prefetched frame, helper waits for it
+    std::atomic<size_t> prefetch_frame_size{0};
+    size_t prefetch_size = 0;  // published by prefetch_frame_size
+    std::mutex prefetch_mutex;
+    std::condition_variable prefetch_cv;
+    std::thread prefetch_thread;
+    bool prefetch_running = false;
+
+    std::vector<int16_t> send_batch;
+    size_t send_batch_pos = 0;
+    std::vector<int16_t> recv_batch;
 };
 
 class PyVoIPController : public VoIPController {
     using VoIPController::VoIPController;
 
     void _handle_state_change(CallState state) override {
+        TimedGilAcquire gil(gil_timing);
         PYBIND11_OVERLOAD(void, VoIPController, _handle_state_change, state);
     };
     void _handle_signal_bars_change(int count) override {
+        TimedGilAcquire gil(gil_timing);
         PYBIND11_OVERLOAD(void, VoIPController, _handle_signal_bars_change, count);
     };
+    void _handle_voice_activity_change(bool active) override {
+        TimedGilAcquire gil(gil_timing);
+        PYBIND11_OVERLOAD(void, VoIPController, _handle_voice_activity_change, active);
+    };
     char *_send_audio_frame_impl(unsigned long len) override {
+        TimedGilAcquire gil(gil_timing);
         PYBIND11_OVERLOAD(char *, VoIPController, _send_audio_frame_impl, len);
     };
+    void _send_audio_frame_view_impl(const py::buffer &frame) override {
+        TimedGilAcquire gil(gil_timing);
+        PYBIND11_OVERLOAD(void, VoIPController, _send_audio_frame_view_impl, frame);
+    };
     void _recv_audio_frame_impl(const py::bytes &frame) override {
+        TimedGilAcquire gil(gil_timing);
         PYBIND11_OVERLOAD(void, VoIPController, _recv_audio_frame_impl, frame);
     };
+    void _recv_audio_frame_view_impl(const py::buffer &frame) override {
+        TimedGilAcquire gil(gil_timing);
+        PYBIND11_OVERLOAD(void, VoIPController, _recv_audio_frame_view_impl, frame);
+    };
 };
 
 class VoIPServerConfig {
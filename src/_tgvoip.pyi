@@ -18,7 +18,7 @@
 
 
 from enum import Enum
-from typing import Optional, List
+from typing import Dict, Optional, List, Tuple, Union
 
 
 class NetType(Enum):
@@ -58,6 +58,23 @@ class CallError(Enum):
     PROXY = ...
 
 
+class EventDispatch(Enum):
+    SYNC = ...
+    THREAD = ...
+    LOOP = ...
+
+
+class AudioEncoding(Enum):
+    RAW = ...
+    OGG_OPUS = ...
+
+
+class RecordingMode(Enum):
+    INCOMING = ...
+    MIXED = ...
+    STEREO = ...
+
+
 class Stats:
     bytes_sent_wifi = ...
     bytes_sent_mobile = ...
@@ -65,6 +82,73 @@ class Stats:
     bytes_recvd_mobile = ...
 
 
+class QualityStats:
+    state = ...
+    signal_bars = ...
+    rtt = ...
+    preferred_relay_id = ...
+    last_error = ...
+    bytes_sent = ...
+    bytes_recvd = ...
+    # bits per second between the two latest stats samples, 0 without them
+    # packet loss and jitter buffer delay are not available
+    send_bitrate = ...
+    recv_bitrate = ...
+
+
+class BufferStats:
+    send_buffered = ...
+    send_capacity = ...
+    recv_buffered = ...
+    recv_capacity = ...
+    send_underruns = ...
+    send_overruns = ...
+    recv_overruns = ...
+
+
+class LatencyStats:
+    count = ...
+    mean = ...
+    max = ...
+    p50 = ...
+    p90 = ...
+    p99 = ...
+    buckets = ...
+
+
+class AudioTimingStats:
+    send_duration = ...
+    send_interval = ...
+    send_late = ...
+    recv_duration = ...
+    recv_interval = ...
+    recv_late = ...
+
+
+class GilStats:
+    wait = ...
+    hold = ...
+
+
+class AudioLevels:
+    send_rms = ...
+    send_peak = ...
+    send_clipped = ...
+    recv_rms = ...
+    recv_peak = ...
+    recv_clipped = ...
+
+
+class RecordingStats:
+    queued = ...
+    capacity = ...
+    written = ...
+    dropped = ...
+    writes = ...
+    late_writes = ...
+    max_write_time = ...
+
+
 # class AudioInputDevice:
 #     _id = ...
 #     display_name = ...
@@ -88,6 +172,7 @@ class Endpoint:
 class VoIPController:
     LIBTGVOIP_VERSION: str = ...
     CONNECTION_MAX_LAYER: int = ...
+    call_id: int = ...
 
     def __init__(self, persistent_state_file: str = ''): ...
     def _init(self) -> None: ...
@@ -106,6 +191,9 @@ class VoIPController:
     def get_preferred_relay_id(self) -> int: ...
     def get_last_error(self) -> CallError: ...
     def get_stats(self) -> Stats: ...
+    def get_quality_stats(self) -> QualityStats: ...
+    def set_stats_sampling(self, interval: int, capacity: int) -> None: ...
+    def get_stats_history(self) -> Dict[str, memoryview]: ...
     def get_debug_log(self) -> str: ...
     def set_audio_output_gain_control_enabled(self, enabled: bool) -> None: ...
     def set_echo_cancellation_strength(self, strength: int) -> None: ...
@@ -127,11 +215,82 @@ class VoIPController:
 
     def _native_io_set(self, val: bool) -> None: ...
 
-    def play(self, path: str) -> bool: ...
+    def _send_zero_copy_set(self, val: bool) -> None: ...
+
+    def _recv_zero_copy_set(self, val: bool) -> None: ...
+
+    def _send_ndarray_set(self, val: bool) -> None: ...
+
+    def _recv_ndarray_set(self, val: bool) -> None: ...
+
+    def _buffered_io_get(self) -> bool: ...
+
+    def _buffered_io_set(self, val: bool) -> None: ...
+
+    def set_audio_buffer_size(self, send_size: int, recv_size: int) -> None: ...
+
+    def set_callback_batching(self, send_duration: int, recv_duration: int) -> None: ...
+
+    def _flush_recv_batch(self) -> None: ...
+
+    def set_send_prefetch(self, frames: int) -> None: ...
+
+    def write_audio(self, data: bytes) -> int: ...
+
+    def read_audio(self, max_length: int) -> bytes: ...
+
+    def get_buffer_stats(self) -> BufferStats: ...
+
+    def get_audio_levels(self) -> AudioLevels: ...
+
+    def get_audio_timing_stats(self) -> AudioTimingStats: ...
+
+    def reset_audio_timing_stats(self) -> None: ...
+
+    def get_gil_stats(self) -> GilStats: ...
+
+    def reset_gil_stats(self) -> None: ...
+
+    @staticmethod
+    def get_process_gil_stats() -> GilStats: ...
+
+    @staticmethod
+    def reset_process_gil_stats() -> None: ...
+
+    def _set_notify_fd(self, fd: int) -> None: ...
+
+    def _wait_recv_audio(self, length: int) -> bool: ...
 
-    def play_on_hold(self, paths: List[str]) -> None: ...
+    def _wait_send_audio(self, length: int) -> bool: ...
 
-    def set_output_file(self, path: str) -> bool: ...
+    def set_event_dispatch(self, mode: EventDispatch) -> None: ...
+
+    def get_event_dispatch(self) -> EventDispatch: ...
+
+    def _get_state(self) -> int: ...
+
+    def wait_for_state(self, state: CallState, timeout: float) -> bool: ...
+
+    def _set_finished(self) -> None: ...
+
+    def _poll_events(self) -> List[Tuple[int, int]]: ...
+
+    def play(self, path: str, preload: bool) -> bool: ...
+
+    def play_buffer(self, data: Union[bytes, bytearray, memoryview]) -> None: ...
+
+    def play_on_hold(self, paths: List[str], preload: bool) -> None: ...
+
+    def set_output_file(self, path: str, encoding: AudioEncoding, bitrate: int, mode: RecordingMode,
+                        queue_duration: int, flush_interval: int) -> bool: ...
+
+    def add_mix_source(self, path: str, gain: float, duck_gain: float, loop: bool, preload: bool) -> int: ...
+
+    def remove_mix_source(self, id: int) -> bool: ...
+
+    def set_mix_source_gain(self, id: int, gain: float, duck_gain: float) -> bool: ...
+
+    def clear_mix_sources(self) -> None: ...
 
     def clear_play_queue(self) -> None: ...
 
@@ -139,14 +298,30 @@ class VoIPController:
 
     def unset_output_file(self) -> None: ...
 
+    def play_fd(self, fd: int, jitter_buffer: int) -> bool: ...
+
+    def set_output_fd(self, fd: int, buffer_duration: int) -> bool: ...
+
+    def unset_output_fd(self) -> None: ...
+
+    def get_recording_stats(self) -> RecordingStats: ...
+
+    def set_voice_activity_detection(self, enabled: bool, aggressiveness: int, hangover: int,
+                                     gate_callback: bool) -> None: ...
+
     def _handle_state_change(self, state: CallState) -> None:
         raise NotImplementedError()
 
     def _handle_signal_bars_change(self, count: int) -> None:
         raise NotImplementedError()
 
+    def _handle_voice_activity_change(self, active: bool) -> None:
+        raise NotImplementedError()
+
     def _send_audio_frame_impl(self, length: int) -> bytes: ...
+    def _send_audio_frame_view_impl(self, frame: memoryview) -> None: ...
     def _recv_audio_frame_impl(self, frame: bytes) -> None: ...
+    def _recv_audio_frame_view_impl(self, frame: memoryview) -> None: ...
 
 
 class VoIPServerConfig:
@@ -154,4 +329,27 @@ class VoIPServerConfig:
     def set_config(json_string: str): ...
 
 
+class AssetCacheStats:
+    size = ...
+    capacity = ...
+    assets = ...
+    hits = ...
+    misses = ...
+    evictions = ...
+
+
+class AssetCache:
+    @staticmethod
+    def set_capacity(capacity: int) -> None: ...
+
+    @staticmethod
+    def get_stats() -> AssetCacheStats: ...
+
+    @staticmethod
+    def clear() -> None: ...
+
+
+def get_stats_snapshot() -> Dict[str, memoryview]: ...
+
+
 __version__: str = ...
@@ -0,0 +1,1323 @@
+/*
+ * PytgVoIP - Telegram VoIP Library for Python
+ * Copyright (C) 2020 bakatrouble <https://github.com/bakatrouble>
+ *
+ * This file is part of PytgVoIP.
+ *
+ * PytgVoIP is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Lesser General Public License as published
+ * by the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * PytgVoIP is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License
+ * along with PytgVoIP.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+
+#include "_tgvoip_audio.h"
+#include <audio/Resampler.h>
+#include <webrtc_dsp/common_audio/vad/include/webrtc_vad.h>
+#include <algorithm>
+#include <cerrno>
+#include <cmath>
+#include <cstring>
+#include <iostream>
+#include <random>
+#ifdef TGVOIP_USE_INSTALLED_OPUS
+#include <opus/opus.h>
+#else
+#include "opus.h"
+#endif
+#include <sys/stat.h>
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <unistd.h>
+#endif
+
+AudioRingBuffer::AudioRingBuffer(size_t capacity) {
+    resize(capacity);
+}
+
+void AudioRingBuffer::resize(size_t capacity) {
+    size_t rounded = 1;
+    while (rounded < capacity)
+        rounded <<= 1;
+    buffer.assign(capacity ? rounded : 0, 0);
+    mask = capacity ? rounded - 1 : 0;
+    head = 0;
+    tail = 0;
+}
+
+size_t AudioRingBuffer::write(const int16_t *data, size_t count) {
+    size_t h = head.load(std::memory_order_relaxed);
+    size_t t = tail.load(std::memory_order_acquire);
+    count = std::min(count, buffer.size() - (h - t));
+    if (count == 0)
+        return 0;
+    size_t offset = h & mask;
+    size_t first = std::min(count, buffer.size() - offset);
+    memcpy(buffer.data() + offset, data, sizeof(int16_t) * first);
+    memcpy(buffer.data(), data + first, sizeof(int16_t) * (count - first));
+    head.store(h + count, std::memory_order_release);
+    return count;
+}
+
+size_t AudioRingBuffer::read(int16_t *data, size_t count) {
+    size_t t = tail.load(std::memory_order_relaxed);
+    size_t h = head.load(std::memory_order_acquire);
+    count = std::min(count, h - t);
+    if (count == 0)
+        return 0;
+    size_t offset = t & mask;
+    size_t first = std::min(count, buffer.size() - offset);
+    memcpy(data, buffer.data() + offset, sizeof(int16_t) * first);
+    memcpy(data + first, buffer.data(), sizeof(int16_t) * (count - first));
+    tail.store(t + count, std::memory_order_release);
+    return count;
+}
+
+size_t AudioRingBuffer::size() const {
+    return head.load(std::memory_order_acquire) - tail.load(std::memory_order_acquire);
+}
+
+size_t AudioRingBuffer::capacity() const {
+    return buffer.size();
+}
+
+std::unique_ptr<MappedFile> MappedFile::open(const std::string &path, bool preload) {
+    std::unique_ptr<MappedFile> mapped(new MappedFile());
+#ifdef _WIN32
+    HANDLE file = CreateFileA(path.c_str(), GENERIC_READ, FILE_SHARE_READ, nullptr, OPEN_EXISTING,
+                              FILE_FLAG_SEQUENTIAL_SCAN, nullptr);
+    if (file == INVALID_HANDLE_VALUE)
+        return nullptr;
+    mapped->file = file;
+    LARGE_INTEGER length;
+    if (!GetFileSizeEx(file, &length))
+        return nullptr;
+    mapped->length = static_cast<size_t>(length.QuadPart);
+    if (mapped->length == 0)
+        return mapped;
+    HANDLE mapping = CreateFileMappingA(file, nullptr, PAGE_READONLY, 0, 0, nullptr);
+    if (mapping == nullptr)
+        return nullptr;
+    mapped->mapping = mapping;
+    mapped->ptr = static_cast<const uint8_t *>(MapViewOfFile(mapping, FILE_MAP_READ, 0, 0, 0));
+    if (mapped->ptr == nullptr)
+        return nullptr;
+    if (preload) {
+        // fault pages in on the calling thread
+        volatile uint8_t sink = 0;
+        for (size_t offset = 0; offset < mapped->length; offset += 4096)
+            sink ^= mapped->ptr[offset];
+    }
+#else
+    int fd = ::open(path.c_str(), O_RDONLY);
+    if (fd == -1)
+        return nullptr;
+    struct stat st {};
+    if (fstat(fd, &st) != 0) {
+        close(fd);
+        return nullptr;
+    }
+    mapped->length = static_cast<size_t>(st.st_size);
+    if (mapped->length == 0) {
+        close(fd);
+        return mapped;
+    }
+    int flags = MAP_SHARED;
+#ifdef MAP_POPULATE
+    if (preload)
+        flags |= MAP_POPULATE;
+#endif
+    void *ptr = mmap(nullptr, mapped->length, PROT_READ, flags, fd, 0);
+    close(fd);
+    if (ptr == MAP_FAILED) {
+        mapped->length = 0;
+        return nullptr;
+    }
+    mapped->ptr = static_cast<const uint8_t *>(ptr);
+    // start readahead now, so the audio thread does not wait for the disk later
+    madvise(ptr, mapped->length, MADV_SEQUENTIAL);
+    madvise(ptr, mapped->length, MADV_WILLNEED);
+#endif
+    return mapped;
+}
+
+MappedFile::~MappedFile() {
+#ifdef _WIN32
+    if (ptr != nullptr)
+        UnmapViewOfFile(ptr);
+    if (mapping != nullptr)
+        CloseHandle(mapping);
+    if (file != nullptr)
+        CloseHandle(file);
+#else
+    if (ptr != nullptr)
+        munmap(const_cast<uint8_t *>(ptr), length);
+#endif
+}
+
+const uint8_t *MappedFile::data() const {
+    return ptr;
+}
+
+size_t MappedFile::size() const {
+    return length;
+}
+
+MappedFileSource::MappedFileSource(std::unique_ptr<MappedFile> file) : file(std::move(file)) {}
+
+size_t MappedFileSource::read(int16_t *buf, size_t size) {
+    size_t count = std::min(size, (file->size() - position) / sizeof(int16_t));
+    if (count == 0)
+        return 0;
+    memcpy(buf, file->data() + position, sizeof(int16_t) * count);
+    position += sizeof(int16_t) * count;
+    return count;
+}
+
+void MappedFileSource::rewind() {
+    position = 0;
+}
+
+static uint16_t read_le16(const uint8_t *p) {
+    return static_cast<uint16_t>(p[0] | (p[1] << 8));
+}
+
+static uint32_t read_le32(const uint8_t *p) {
+    return p[0] | (p[1] << 8) | (p[2] << 16) | (static_cast<uint32_t>(p[3]) << 24);
+}
+
+static unsigned int gcd(unsigned int a, unsigned int b) {
+    while (b) {
+        unsigned int t = a % b;
+        a = b;
+        b = t;
+    }
+    return a;
+}
+
+WavSource::WavSource(std::unique_ptr<MappedFile> file, const uint8_t *data, size_t frames, unsigned int channels,
+                     unsigned int rate)
+        : file(std::move(file)), data(data), frames(frames), channels(channels), rate(rate) {
+    unsigned int g = gcd(rate, 48000);
+    size_t block_in = rate / g;
+    size_t block_out = 48000 / g;
+    size_t blocks = std::max<size_t>(1, rate / 50 / block_in);  // about 20 ms of input
+    chunk_in = block_in * blocks;
+    chunk_out = block_out * blocks;
+    mono.resize(chunk_in + 1);
+    converted.resize(chunk_out);
+}
+
+std::unique_ptr<AudioSource> WavSource::open(std::unique_ptr<MappedFile> &file) {
+    const uint8_t *ptr = file->data();
+    size_t size = file->size();
+    if (size < 12 || memcmp(ptr, "RIFF", 4) != 0 || memcmp(ptr + 8, "WAVE", 4) != 0)
+        return nullptr;
+    unsigned int format = 0, channels = 0, rate = 0, block_align = 0, bits = 0;
+    const uint8_t *data = nullptr;
+    size_t data_size = 0;
+    size_t offset = 12;
+    while (offset + 8 <= size && data == nullptr) {
+        const uint8_t *chunk = ptr + offset;
+        size_t length = read_le32(chunk + 4);
+        size_t body = offset + 8;
+        if (memcmp(chunk, "fmt ", 4) == 0 && length >= 16 && body + length <= size) {
+            format = read_le16(chunk + 8);
+            channels = read_le16(chunk + 10);
+            rate = read_le32(chunk + 12);
+            block_align = read_le16(chunk + 20);
+            bits = read_le16(chunk + 22);
+            if (format == 0xFFFE && length >= 40)  // WAVE_FORMAT_EXTENSIBLE, subformat GUID starts with the format
+                format = read_le16(chunk + 32);
+        } else if (memcmp(chunk, "data", 4) == 0) {
+            data = ptr + body;
+            data_size = std::min(length, size - body);  // length is bogus in streamed files
+        }
+        offset = body + length + (length & 1);
+    }
+    if (data == nullptr || format != 1 || bits != 16 || channels == 0 || rate == 0
+            || block_align != channels * sizeof(int16_t)) {
+        std::cerr << "Unsupported WAV format (" << format << ", " << bits << " bits, " << channels << " channels, "
+                  << rate << " Hz), only 16-bit PCM is supported" << std::endl;
+        return nullptr;
+    }
+    return std::unique_ptr<AudioSource>(new WavSource(std::move(file), data, data_size / block_align, channels, rate));
+}
+
+size_t WavSource::convert() {
+    size_t count = std::min(chunk_in, frames - position);
+    // one sample of lookahead is needed for interpolation
+    for (size_t i = 0; i < count + 1; ++i) {
+        size_t frame = std::min(position + i, frames - 1);
+        const uint8_t *p = data + frame * channels * sizeof(int16_t);
+        int32_t sum = 0;
+        for (unsigned int c = 0; c < channels; ++c)
+            sum += static_cast<int16_t>(read_le16(p + c * sizeof(int16_t)));
+        mono[i] = static_cast<int16_t>(sum / static_cast<int32_t>(channels));
+    }
+    position += count;
+    if (rate == 48000) {
+        std::copy(mono.begin(), mono.begin() + count, converted.begin());
+        return count;
+    }
+    return tgvoip::audio::Resampler::Convert(mono.data(), converted.data(), count, chunk_out,
+                                             static_cast<int>(chunk_out), static_cast<int>(chunk_in));
+}
+
+size_t WavSource::read(int16_t *buf, size_t size) {
+    size_t filled = 0;
+    while (filled < size) {
+        if (converted_pos >= converted_len) {
+            if (position >= frames)
+                break;
+            converted_len = convert();
+            converted_pos = 0;
+        }
+        size_t count = std::min(size - filled, converted_len - converted_pos);
+        memcpy(buf + filled, converted.data() + converted_pos, sizeof(int16_t) * count);
+        converted_pos += count;
+        filled += count;
+    }
+    return filled;
+}
+
+void WavSource::rewind() {
+    position = 0;
+    converted_pos = 0;
+    converted_len = 0;
+}
+
+static uint64_t read_le64(const uint8_t *p) {
+    return read_le32(p) | (static_cast<uint64_t>(read_le32(p + 4)) << 32);
+}
+
+OggReader::OggReader(const uint8_t *data, size_t size) : data(data), size(size) {
+    packet_buffer.reserve(8192);
+}
+
+bool OggReader::next_page() {
+    while (offset + 27 <= size) {
+        const uint8_t *page = data + offset;
+        if (memcmp(page, "OggS", 4) != 0) {
+            // resynchronize after garbage
+            const uint8_t *next = static_cast<const uint8_t *>(memchr(page + 1, 'O', size - offset - 1));
+            offset = next == nullptr ? size : next - data;
+            continue;
+        }
+        size_t count = page[26];
+        if (offset + 27 + count > size)
+            return false;
+        size_t body_size = 0;
+        for (size_t i = 0; i < count; ++i)
+            body_size += page[27 + i];
+        if (offset + 27 + count + body_size > size)
+            return false;
+        offset += 27 + count + body_size;
+        uint32_t page_serial = read_le32(page + 14);
+        if (!serial_set) {
+            serial = page_serial;
+            serial_set = true;
+        } else if (page_serial != serial) {
+            continue;
+        }
+        header_type = page[5];
+        page_granule = static_cast<int64_t>(read_le64(page + 6));
+        lacing = page + 27;
+        segments = count;
+        segment = 0;
+        body = page + 27 + count;
+        body_offset = 0;
+        return true;
+    }
+    return false;
+}
+
+bool OggReader::next_packet(const uint8_t *&packet, size_t &length, int64_t &granule, bool &eos) {
+    packet_buffer.clear();
+    bool continued = false;
+    while (true) {
+        if (segment >= segments) {
+            if (!next_page())
+                return false;
+            if ((header_type & 0x01) && !continued) {
+                // continuation of a packet which was not started, e.g. after a lost page
+                while (segment < segments) {
+                    uint8_t lace = lacing[segment++];
+                    body_offset += lace;
+                    if (lace < 255)
+                        break;
+                }
+                continue;
+            }
+        }
+        size_t start = body_offset;
+        bool complete = false;
+        while (segment < segments) {
+            uint8_t lace = lacing[segment++];
+            body_offset += lace;
+            if (lace < 255) {
+                complete = true;
+                break;
+            }
+        }
+        if (complete && !continued) {
+            packet = body + start;
+            length = body_offset - start;
+        } else {
+            packet_buffer.insert(packet_buffer.end(), body + start, body + body_offset);
+            continued = true;
+            if (!complete)
+                continue;
+            packet = packet_buffer.data();
+            length = packet_buffer.size();
+        }
+        granule = segment == segments ? page_granule : -1;
+        eos = (header_type & 0x04) != 0;
+        return true;
+    }
+}
+
+void OggReader::rewind() {
+    offset = 0;
+    segments = 0;
+    segment = 0;
+}
+
+OggOpusSource::OggOpusSource(std::unique_ptr<MappedFile> file, OpusDecoder *decoder, unsigned int pre_skip)
+        : file(std::move(file)), reader(this->file->data(), this->file->size()), decoder(decoder), pre_skip(pre_skip),
+          skip(pre_skip), decoded(5760) {}  // 120 ms, the longest Opus packet
+
+OggOpusSource::~OggOpusSource() {
+    opus_decoder_destroy(decoder);
+}
+
+std::unique_ptr<AudioSource> OggOpusSource::open(std::unique_ptr<MappedFile> &file) {
+    OggReader reader(file->data(), file->size());
+    const uint8_t *packet;
+    size_t length;
+    int64_t granule;
+    bool eos;
+    if (!reader.next_packet(packet, length, granule, eos) || length < 19 || memcmp(packet, "OpusHead", 8) != 0) {
+        std::cerr << "Unsupported Ogg stream, only Opus is supported" << std::endl;
+        return nullptr;
+    }
+    unsigned int channels = packet[9];
+    unsigned int pre_skip = read_le16(packet + 10);
+    int16_t gain = static_cast<int16_t>(read_le16(packet + 16));
+    unsigned int mapping_family = packet[18];
+    if (mapping_family != 0 || channels == 0 || channels > 2) {
+        std::cerr << "Unsupported Opus channel mapping (family " << mapping_family << ", " << channels
+                  << " channels), only mono and stereo are supported" << std::endl;
+        return nullptr;
+    }
+    int error;
+    // stereo streams are downmixed by the decoder itself
+    OpusDecoder *decoder = opus_decoder_create(48000, 1, &error);
+    if (error != OPUS_OK) {
+        std::cerr << "Unable to create Opus decoder: " << opus_strerror(error) << std::endl;
+        return nullptr;
+    }
+    opus_decoder_ctl(decoder, OPUS_SET_GAIN(gain));
+    std::unique_ptr<OggOpusSource> source(new OggOpusSource(std::move(file), decoder, pre_skip));
+    source->rewind();
+    return std::unique_ptr<AudioSource>(source.release());
+}
+
+size_t OggOpusSource::decode() {
+    const uint8_t *packet;
+    size_t length;
+    int64_t granule;
+    bool eos;
+    while (!finished) {
+        if (!reader.next_packet(packet, length, granule, eos)) {
+            finished = true;
+            break;
+        }
+        int count = opus_decode(decoder, packet, static_cast<int32_t>(length), decoded.data(),
+                                static_cast<int>(decoded.size()), 0);
+        if (count <= 0)
+            continue;  // corrupted packet
+        size_t start = 0;
+        if (skip > 0) {
+            start = static_cast<size_t>(std::min<int64_t>(skip, count));
+            skip -= start;
+        }
+        size_t end = static_cast<size_t>(count);
+        if (eos && granule >= 0) {
+            // last page granule position trims padding at the end of the stream
+            int64_t total = granule - pre_skip;
+            int64_t available = std::max<int64_t>(0, total - position);
+            end = std::min<size_t>(end, start + static_cast<size_t>(std::min<int64_t>(available, count)));
+            finished = true;
+        }
+        if (end <= start)
+            continue;
+        decoded_pos = start;
+        position += end - start;
+        return end;
+    }
+    return 0;
+}
+
+size_t OggOpusSource::read(int16_t *buf, size_t size) {
+    size_t filled = 0;
+    while (filled < size) {
+        if (decoded_pos >= decoded_len) {
+            decoded_len = decode();
+            if (decoded_len == 0)
+                break;
+        }
+        size_t count = std::min(size - filled, decoded_len - decoded_pos);
+        memcpy(buf + filled, decoded.data() + decoded_pos, sizeof(int16_t) * count);
+        decoded_pos += count;
+        filled += count;
+    }
+    return filled;
+}
+
+void OggOpusSource::rewind() {
+    reader.rewind();
+    opus_decoder_ctl(decoder, OPUS_RESET_STATE);
+    skip = pre_skip;
+    position = 0;
+    finished = false;
+    decoded_pos = 0;
+    decoded_len = 0;
+    // skip identification and comment headers
+    const uint8_t *packet;
+    size_t length;
+    int64_t granule;
+    bool eos;
+    for (int i = 0; i < 2; ++i)
+        reader.next_packet(packet, length, granule, eos);
+}
+
+#ifndef _WIN32
+std::unique_ptr<AudioSource> FdAudioSource::open(int fd, size_t prebuffer) {
+    int own_fd = dup(fd);
+    if (own_fd == -1)
+        return nullptr;
+    int flags = fcntl(own_fd, F_GETFL);
+    if (flags == -1 || fcntl(own_fd, F_SETFL, flags | O_NONBLOCK) == -1) {
+        close(own_fd);
+        return nullptr;
+    }
+    return std::unique_ptr<AudioSource>(new FdAudioSource(own_fd, prebuffer));
+}
+
+FdAudioSource::FdAudioSource(int fd, size_t prebuffer)
+        : fd(fd), prebuffer(prebuffer), buffer(2 * std::max(prebuffer, size_t(960))), chunk(4800) {}
+
+FdAudioSource::~FdAudioSource() {
+    close(fd);
+}
+
+void FdAudioSource::fill() {
+    uint8_t *bytes = reinterpret_cast<uint8_t *>(chunk.data());
+    while (!eof) {
+        size_t space = std::min(buffer.capacity() - buffer.size(), chunk.size());
+        if (space == 0)
+            break;
+        size_t offset = 0;
+        if (has_partial) {
+            bytes[0] = partial;
+            offset = 1;
+        }
+        size_t requested = sizeof(int16_t) * space - offset;
+        ssize_t length = ::read(fd, bytes + offset, requested);
+        if (length < 0) {
+            if (errno == EINTR)
+                continue;
+            if (errno != EAGAIN && errno != EWOULDBLOCK) {
+                std::cerr << "Unable to read audio from file descriptor: " << strerror(errno) << std::endl;
+                eof = true;
+            }
+            break;
+        }
+        if (length == 0) {
+            eof = true;
+            break;
+        }
+        size_t total = offset + length;
+        has_partial = total % sizeof(int16_t) != 0;
+        if (has_partial)
+            partial = bytes[total - 1];
+        buffer.write(chunk.data(), total / sizeof(int16_t));
+        if (size_t(length) < requested)
+            break;
+    }
+}
+
+size_t FdAudioSource::read(int16_t *buf, size_t size) {
+    fill();
+    if (buffering) {
+        if (buffer.size() >= prebuffer || (eof && buffer.size() > 0)) {
+            buffering = false;
+        } else if (eof) {
+            return 0;
+        } else {
+            memset(buf, 0, sizeof(int16_t) * size);
+            return size;
+        }
+    }
+    size_t read_size = buffer.read(buf, size);
+    if (read_size < size) {
+        if (eof)
+            return read_size;
+        memset(buf + read_size, 0, sizeof(int16_t) * (size - read_size));
+        buffering = true;
+    }
+    return size;
+}
+
+void FdAudioSource::rewind() {}
+#else
+std::unique_ptr<AudioSource> FdAudioSource::open(int fd, size_t prebuffer) {
+    std::cerr << "File descriptor audio sources are not supported on Windows" << std::endl;
+    return nullptr;
+}
+#endif
+
+AudioMixer::AudioMixer() : samples(960), sum(960) {}
+
+int AudioMixer::add(std::unique_ptr<AudioSource> source, float gain, float duck_gain, bool loop) {
+    int id = next_id++;
+    channels.push_back(Channel {id, std::move(source), gain, duck_gain, loop, gain});
+    return id;
+}
+
+std::unique_ptr<AudioSource> AudioMixer::remove(int id) {
+    auto it = std::find_if(channels.begin(), channels.end(), [id](const Channel &c) { return c.id == id; });
+    if (it == channels.end())
+        return nullptr;
+    std::unique_ptr<AudioSource> source = std::move(it->source);
+    channels.erase(it);
+    return source;
+}
+
+bool AudioMixer::set_gain(int id, float gain, float duck_gain) {
+    for (auto &channel : channels) {
+        if (channel.id == id) {
+            channel.gain = gain;
+            channel.duck_gain = duck_gain;
+            return true;
+        }
+    }
+    return false;
+}
+
+std::vector<std::unique_ptr<AudioSource>> AudioMixer::clear() {
+    std::vector<std::unique_ptr<AudioSource>> sources;
+    for (auto &channel : channels)
+        sources.push_back(std::move(channel.source));
+    channels.clear();
+    return sources;
+}
+
+bool AudioMixer::empty() const {
+    return channels.empty();
+}
+
+void AudioMixer::mix(int16_t *buf, size_t size, bool ducking) {
+    if (channels.empty())
+        return;
+    if (samples.size() < size) {
+        samples.resize(size);
+        sum.resize(size);
+    }
+    std::copy(buf, buf + size, sum.begin());
+    for (auto it = channels.begin(); it != channels.end();) {
+        Channel &channel = *it;
+        size_t count = channel.source->read(samples.data(), size);
+        while (count < size && channel.loop) {
+            channel.source->rewind();
+            size_t more = channel.source->read(samples.data() + count, size - count);
+            if (more == 0)
+                break;  // empty source
+            count += more;
+        }
+        float target = ducking ? channel.gain * channel.duck_gain : channel.gain;
+        float step = (target - channel.current_gain) / static_cast<float>(size);
+        float gain = channel.current_gain;
+        for (size_t i = 0; i < count; ++i) {
+            gain += step;
+            sum[i] += static_cast<int32_t>(samples[i] * gain);
+        }
+        channel.current_gain = target;
+        if (count < size)
+            it = channels.erase(it);
+        else
+            ++it;
+    }
+    for (size_t i = 0; i < size; ++i)
+        buf[i] = static_cast<int16_t>(std::min<int32_t>(std::max<int32_t>(sum[i], INT16_MIN), INT16_MAX));
+}
+
+VoiceActivityDetector::VoiceActivityDetector(int aggressiveness, unsigned int hangover)
+        : vad(WebRtcVad_Create()), hangover(48 * hangover) {
+    WebRtcVad_Init(vad);
+    WebRtcVad_set_mode(vad, aggressiveness);
+}
+
+VoiceActivityDetector::~VoiceActivityDetector() {
+    WebRtcVad_Free(vad);
+}
+
+bool VoiceActivityDetector::process(const int16_t *buf, size_t size) {
+    // trailing partial block does not affect the decision
+    for (size_t offset = 0; offset + 480 <= size; offset += 480) {
+        if (WebRtcVad_Process(vad, 48000, buf + offset, 480) == 1) {
+            voiced = true;
+            silence = 0;
+        } else {
+            silence += 480;
+        }
+    }
+    if (voiced && silence > hangover)
+        voiced = false;
+    return voiced;
+}
+
+bool VoiceActivityDetector::active() const {
+    return voiced;
+}
+
+void AudioLevelMeter::process(const int16_t *buf, size_t size) {
+    uint64_t sum = 0;
+    int max = 0;
+    uint64_t clipped = 0;
+    for (size_t i = 0; i < size; i++) {
+        int value = std::abs(int(buf[i]));
+        sum += uint64_t(value * value);
+        if (value > max)
+            max = value;
+        if (value >= INT16_MAX)
+            clipped++;
+    }
+    sum_squares += sum;
+    samples += size;
+    int current = peak.load();
+    while (max > current && !peak.compare_exchange_weak(current, max)) {}
+    if (clipped)
+        clipped_samples += clipped;
+}
+
+float AudioLevelMeter::take_rms() {
+    uint64_t count = samples.exchange(0);
+    uint64_t sum = sum_squares.exchange(0);
+    if (!count)
+        return 0;
+    return float(std::sqrt(double(sum) / count) / 32768.0);
+}
+
+float AudioLevelMeter::take_peak() {
+    return peak.exchange(0) / 32768.0f;
+}
+
+uint64_t AudioLevelMeter::clipped() const {
+    return clipped_samples;
+}
+
+const size_t LatencyHistogram::BUCKETS;
+
+void LatencyHistogram::record(uint64_t us) {
+    size_t bucket = 0;
+    for (uint64_t value = us; value && bucket < BUCKETS - 1; value >>= 1)
+        bucket++;
+    buckets[bucket].fetch_add(1, std::memory_order_relaxed);
+    total.fetch_add(us, std::memory_order_relaxed);
+    uint64_t current = max.load(std::memory_order_relaxed);
+    while (us > current && !max.compare_exchange_weak(current, us, std::memory_order_relaxed)) {}
+}
+
+LatencyStats LatencyHistogram::get_stats() const {
+    LatencyStats stats{};
+    stats.buckets.resize(BUCKETS);
+    for (size_t i = 0; i < BUCKETS; i++) {
+        stats.buckets[i] = buckets[i].load(std::memory_order_relaxed);
+        stats.count += stats.buckets[i];
+    }
+    if (!stats.count)
+        return stats;
+    uint64_t max_us = max.load(std::memory_order_relaxed);
+    stats.mean = double(total.load(std::memory_order_relaxed)) / stats.count / 1e6;
+    stats.max = max_us / 1e6;
+    double *percentiles[] = {&stats.p50, &stats.p90, &stats.p99};
+    double quantiles[] = {0.5, 0.9, 0.99};
+    uint64_t cumulative = 0;
+    size_t q = 0;
+    for (size_t i = 0; i < BUCKETS && q < 3; i++) {
+        cumulative += stats.buckets[i];
+        for (; q < 3 && cumulative >= quantiles[q] * stats.count; q++)
+            *percentiles[q] = std::min(uint64_t(1) << i, max_us) / 1e6;
+    }
+    return stats;
+}
+
+void LatencyHistogram::reset() {
+    for (auto &bucket : buckets)
+        bucket = 0;
+    total = 0;
+    max = 0;
+}
+
+void CallbackTiming::record(std::chrono::steady_clock::time_point start, size_t frame_size) {
+    auto finish = std::chrono::steady_clock::now();
+    uint64_t us = std::chrono::duration_cast<std::chrono::microseconds>(finish - start).count();
+    duration.record(us);
+    if (last != std::chrono::steady_clock::time_point())
+        interval.record(std::chrono::duration_cast<std::chrono::microseconds>(start - last).count());
+    last = start;
+    // 48 kHz mono
+    if (frame_size && us * 48 > frame_size * 1000)
+        ++late;
+}
+
+void CallbackTiming::reset() {
+    duration.reset();
+    interval.reset();
+    late = 0;
+}
+
+static std::unique_ptr<AudioSource> open_file_source(const std::string &path, bool preload) {
+    std::unique_ptr<MappedFile> file = MappedFile::open(path, preload);
+    if (!file)
+        return nullptr;
+    if (file->size() >= 12 && memcmp(file->data(), "RIFF", 4) == 0)
+        return WavSource::open(file);
+    if (file->size() >= 4 && memcmp(file->data(), "OggS", 4) == 0)
+        return OggOpusSource::open(file);
+    return std::unique_ptr<AudioSource>(new MappedFileSource(std::move(file)));
+}
+
+class CachedAssetSource : public AudioSource {
+public:
+    explicit CachedAssetSource(std::shared_ptr<const std::vector<int16_t>> samples) : samples(std::move(samples)) {}
+
+    size_t read(int16_t *buf, size_t size) override {
+        size_t count = std::min(size, samples->size() - position);
+        memcpy(buf, samples->data() + position, sizeof(int16_t) * count);
+        position += count;
+        return count;
+    }
+
+    void rewind() override {
+        position = 0;
+    }
+
+private:
+    std::shared_ptr<const std::vector<int16_t>> samples;
+    size_t position = 0;
+};
+
+AssetCache &AssetCache::instance() {
+    static AssetCache cache;
+    return cache;
+}
+
+void AssetCache::set_capacity(size_t capacity) {
+    AssetCache &cache = instance();
+    std::lock_guard<std::mutex> lock(cache.mutex);
+    cache.capacity = capacity;
+    cache.evict();
+}
+
+bool AssetCache::enabled() {
+    AssetCache &cache = instance();
+    std::lock_guard<std::mutex> lock(cache.mutex);
+    return cache.capacity > 0;
+}
+
+AssetCacheStats AssetCache::get_stats() {
+    AssetCache &cache = instance();
+    std::lock_guard<std::mutex> lock(cache.mutex);
+    return AssetCacheStats {
+        cache.size,
+        cache.capacity,
+        cache.entries.size(),
+        cache.hits,
+        cache.misses,
+        cache.evictions,
+    };
+}
+
+void AssetCache::clear() {
+    AssetCache &cache = instance();
+    std::list<Entry> entries;
+    std::lock_guard<std::mutex> lock(cache.mutex);
+    std::swap(cache.entries, entries);
+    cache.index.clear();
+    cache.size = 0;
+}
+
+void AssetCache::evict() {
+    while (size > capacity && !entries.empty()) {
+        Entry &entry = entries.back();
+        size -= sizeof(int16_t) * entry.samples->size();
+        index.erase(entry.path);
+        entries.pop_back();
+        ++evictions;
+    }
+}
+
+std::unique_ptr<AudioSource> AssetCache::open(const std::string &path, bool preload) {
+    AssetCache &cache = instance();
+#ifdef _WIN32
+    struct _stat64 st;
+    if (_stat64(path.c_str(), &st) != 0)
+        return nullptr;
+#else
+    struct stat st;
+    if (stat(path.c_str(), &st) != 0)
+        return nullptr;
+#endif
+    // files rewritten within the same second must not be served stale where the platform allows it
+#if defined(_WIN32)
+    auto mtime = static_cast<int64_t>(st.st_mtime) * 1000000000;
+#elif defined(__APPLE__)
+    auto mtime = static_cast<int64_t>(st.st_mtimespec.tv_sec) * 1000000000 + st.st_mtimespec.tv_nsec;
+#else
+    auto mtime = static_cast<int64_t>(st.st_mtim.tv_sec) * 1000000000 + st.st_mtim.tv_nsec;
+#endif
+    auto file_size = static_cast<uint64_t>(st.st_size);
+    size_t capacity;
+    {
+        std::lock_guard<std::mutex> lock(cache.mutex);
+        auto it = cache.index.find(path);
+        if (it != cache.index.end() && it->second->mtime == mtime && it->second->file_size == file_size) {
+            cache.entries.splice(cache.entries.begin(), cache.entries, it->second);
+            ++cache.hits;
+            return std::unique_ptr<AudioSource>(new CachedAssetSource(it->second->samples));
+        }
+        ++cache.misses;
+        capacity = cache.capacity;
+    }
+
+    // decoding happens outside the lock, concurrent misses of the same asset decode it more than once
+    std::unique_ptr<AudioSource> source = open_file_source(path, preload);
+    if (!source)
+        return nullptr;
+    std::shared_ptr<std::vector<int16_t>> samples = std::make_shared<std::vector<int16_t>>();
+    size_t count;
+    do {
+        size_t offset = samples->size();
+        if (sizeof(int16_t) * offset > capacity) {
+            // wouldn't be cached anyway, decoding it upfront on every play would be slower than streaming
+            source->rewind();
+            return source;
+        }
+        samples->resize(offset + 48000);
+        count = source->read(samples->data() + offset, 48000);
+        samples->resize(offset + count);
+    } while (count > 0);
+    samples->shrink_to_fit();
+
+    std::lock_guard<std::mutex> lock(cache.mutex);
+    size_t bytes = sizeof(int16_t) * samples->size();
+    if (bytes <= cache.capacity) {
+        auto it = cache.index.find(path);
+        if (it != cache.index.end()) {
+            cache.size -= sizeof(int16_t) * it->second->samples->size();
+            cache.entries.erase(it->second);
+            cache.index.erase(it);
+        }
+        cache.entries.push_front(Entry {path, mtime, file_size, samples});
+        cache.index[path] = cache.entries.begin();
+        cache.size += bytes;
+        cache.evict();
+    }
+    return std::unique_ptr<AudioSource>(new CachedAssetSource(samples));
+}
+
+std::unique_ptr<AudioSource> open_audio_source(const std::string &path, bool preload) {
+    if (AssetCache::enabled())
+        return AssetCache::open(path, preload);
+    return open_file_source(path, preload);
+}
+
+RawFileSink::RawFileSink(FILE *file) : file(file) {}
+
+RawFileSink::~RawFileSink() {
+    fclose(file);
+}
+
+bool RawFileSink::write(const int16_t *buf, size_t size) {
+    size_t written_size = fwrite(buf, sizeof(int16_t), size, file);
+    if (written_size != size) {
+        std::cerr << "Written size (" << written_size << ") does not match expected (" << size << ")" << std::endl;
+        return false;
+    }
+    return true;
+}
+
+static const uint32_t *ogg_crc_table() {
+    static uint32_t table[256];
+    static bool initialized = [] {
+        for (uint32_t i = 0; i < 256; ++i) {
+            uint32_t r = i << 24;
+            for (int j = 0; j < 8; ++j)
+                r = (r & 0x80000000u) ? (r << 1) ^ 0x04c11db7u : r << 1;
+            table[i] = r;
+        }
+        return true;
+    }();
+    (void) initialized;
+    return table;
+}
+
+static uint32_t ogg_crc(uint32_t crc, const uint8_t *data, size_t size) {
+    const uint32_t *table = ogg_crc_table();
+    for (size_t i = 0; i < size; ++i)
+        crc = (crc << 8) ^ table[((crc >> 24) & 0xff) ^ data[i]];
+    return crc;
+}
+
+static void write_le16(uint8_t *p, uint16_t value) {
+    p[0] = static_cast<uint8_t>(value);
+    p[1] = static_cast<uint8_t>(value >> 8);
+}
+
+static void write_le32(uint8_t *p, uint32_t value) {
+    write_le16(p, static_cast<uint16_t>(value));
+    write_le16(p + 2, static_cast<uint16_t>(value >> 16));
+}
+
+static void write_le64(uint8_t *p, uint64_t value) {
+    write_le32(p, static_cast<uint32_t>(value));
+    write_le32(p + 4, static_cast<uint32_t>(value >> 32));
+}
+
+OggOpusSink::OggOpusSink(FILE *file, OpusEncoder *encoder, unsigned int channels, unsigned int pre_skip)
+        : file(file), encoder(encoder), channels(channels), pre_skip(pre_skip), serial(std::random_device()()),
+          frame(960 * channels), packet(4000) {
+    page_lacing.reserve(255);
+    page_body.reserve(255 * 255);
+}
+
+std::unique_ptr<AudioSink> OggOpusSink::open(FILE *file, int bitrate, unsigned int channels) {
+    int error;
+    OpusEncoder *encoder = opus_encoder_create(48000, static_cast<int>(channels), OPUS_APPLICATION_VOIP, &error);
+    if (error != OPUS_OK) {
+        std::cerr << "Unable to create Opus encoder: " << opus_strerror(error) << std::endl;
+        fclose(file);
+        return nullptr;
+    }
+    opus_encoder_ctl(encoder, OPUS_SET_BITRATE(bitrate));
+    int32_t lookahead = 0;
+    opus_encoder_ctl(encoder, OPUS_GET_LOOKAHEAD(&lookahead));
+    std::unique_ptr<OggOpusSink> sink(new OggOpusSink(file, encoder, channels, static_cast<unsigned int>(lookahead)));
+    if (!sink->write_headers())
+        return nullptr;
+    return std::unique_ptr<AudioSink>(sink.release());
+}
+
+OggOpusSink::~OggOpusSink() {
+    // encoder delay is flushed with silence, final granule position trims it on playback
+    while (ok && encoded < samples + pre_skip) {
+        std::fill(frame.begin() + frame_len, frame.end(), 0);
+        frame_len = frame.size();
+        encode_frame();
+    }
+    if (ok)
+        flush_page(true);
+    opus_encoder_destroy(encoder);
+    fclose(file);
+}
+
+bool OggOpusSink::write_headers() {
+    uint8_t head[19];
+    memcpy(head, "OpusHead", 8);
+    head[8] = 1;  // version
+    head[9] = static_cast<uint8_t>(channels);
+    write_le16(head + 10, static_cast<uint16_t>(pre_skip));
+    write_le32(head + 12, 48000);
+    write_le16(head + 16, 0);  // output gain
+    head[18] = 0;  // channel mapping family
+    static const char vendor[] = "pytgvoip";
+    uint8_t tags[8 + 4 + sizeof(vendor) - 1 + 4];
+    memcpy(tags, "OpusTags", 8);
+    write_le32(tags + 8, sizeof(vendor) - 1);
+    memcpy(tags + 12, vendor, sizeof(vendor) - 1);
+    write_le32(tags + 12 + sizeof(vendor) - 1, 0);  // no user comments
+    return write_header(head, sizeof(head), 0x02) && write_header(tags, sizeof(tags), 0);
+}
+
+bool OggOpusSink::write(const int16_t *buf, size_t size) {
+    samples += size / channels;
+    while (size > 0 && ok) {
+        size_t count = std::min(size, frame.size() - frame_len);
+        memcpy(frame.data() + frame_len, buf, sizeof(int16_t) * count);
+        frame_len += count;
+        buf += count;
+        size -= count;
+        if (frame_len == frame.size())
+            encode_frame();
+    }
+    return ok;
+}
+
+bool OggOpusSink::encode_frame() {
+    int32_t length = opus_encode(encoder, frame.data(), static_cast<int>(frame.size() / channels), packet.data(),
+                                 static_cast<int32_t>(packet.size()));
+    frame_len = 0;
+    encoded += frame.size() / channels;
+    if (length < 0) {
+        std::cerr << "Unable to encode Opus packet: " << opus_strerror(length) << std::endl;
+        return ok = false;
+    }
+    return add_packet(packet.data(), static_cast<size_t>(length));
+}
+
+bool OggOpusSink::add_packet(const uint8_t *data, size_t length) {
+    size_t segments = length / 255 + 1;
+    if (page_lacing.size() + segments > 255 && !flush_page(false))
+        return false;
+    // encoded already includes this packet, which goes to the next page if the current one is full
+    page_granule = encoded;
+    for (size_t i = 0; i < segments - 1; ++i)
+        page_lacing.push_back(255);
+    page_lacing.push_back(static_cast<uint8_t>(length % 255));
+    page_body.insert(page_body.end(), data, data + length);
+    if (++page_packets == 50)
+        return flush_page(false);
+    return true;
+}
+
+bool OggOpusSink::flush_page(bool eos) {
+    if (page_lacing.empty() && !eos)
+        return true;
+    // granule position of a page is the end of its last packet
+    return write_page(eos ? 0x04 : 0, static_cast<int64_t>(std::min(page_granule, samples + pre_skip)));
+}
+
+bool OggOpusSink::write_header(const uint8_t *data, size_t length, uint8_t header_type) {
+    // header packets take whole pages
+    for (size_t i = 0; i < length / 255; ++i)
+        page_lacing.push_back(255);
+    page_lacing.push_back(static_cast<uint8_t>(length % 255));
+    page_body.assign(data, data + length);
+    return write_page(header_type, 0);
+}
+
+bool OggOpusSink::write_page(uint8_t header_type, int64_t granule) {
+    size_t count = page_lacing.size();
+    uint8_t header[27 + 255];
+    memcpy(header, "OggS", 4);
+    header[4] = 0;
+    header[5] = header_type;
+    write_le64(header + 6, static_cast<uint64_t>(granule));
+    write_le32(header + 14, serial);
+    write_le32(header + 18, sequence++);
+    write_le32(header + 22, 0);
+    header[26] = static_cast<uint8_t>(count);
+    memcpy(header + 27, page_lacing.data(), count);
+    write_le32(header + 22, ogg_crc(ogg_crc(0, header, 27 + count), page_body.data(), page_body.size()));
+    ok = fwrite(header, 1, 27 + count, file) == 27 + count
+            && fwrite(page_body.data(), 1, page_body.size(), file) == page_body.size();
+    if (!ok)
+        std::cerr << "Unable to write Ogg page" << std::endl;
+    page_lacing.clear();
+    page_body.clear();
+    page_packets = 0;
+    return ok;
+}
+
+#ifndef _WIN32
+std::unique_ptr<AudioSink> FdAudioSink::open(int fd, size_t buffer_size) {
+    int own_fd = dup(fd);
+    if (own_fd == -1)
+        return nullptr;
+    int flags = fcntl(own_fd, F_GETFL);
+    if (flags == -1 || fcntl(own_fd, F_SETFL, flags | O_NONBLOCK) == -1) {
+        close(own_fd);
+        return nullptr;
+    }
+    return std::unique_ptr<AudioSink>(new FdAudioSink(own_fd, buffer_size));
+}
+
+FdAudioSink::FdAudioSink(int fd, size_t buffer_size) : fd(fd), capacity(sizeof(int16_t) * buffer_size) {
+    pending.reserve(capacity + 1);
+}
+
+FdAudioSink::~FdAudioSink() {
+    close(fd);
+}
+
+bool FdAudioSink::flush() {
+    while (!pending.empty()) {
+        ssize_t length = ::write(fd, pending.data(), pending.size());
+        if (length < 0) {
+            if (errno == EINTR)
+                continue;
+            if (errno == EAGAIN || errno == EWOULDBLOCK)
+                return true;
+            std::cerr << "Unable to write audio to file descriptor: " << strerror(errno) << std::endl;
+            return false;
+        }
+        pending.erase(pending.begin(), pending.begin() + length);
+    }
+    return true;
+}
+
+bool FdAudioSink::write(const int16_t *buf, size_t size) {
+    if (!flush())
+        return false;
+    const uint8_t *bytes = reinterpret_cast<const uint8_t *>(buf);
+    size_t length = sizeof(int16_t) * size;
+    while (pending.empty() && length > 0) {
+        ssize_t written = ::write(fd, bytes, length);
+        if (written < 0) {
+            if (errno == EINTR)
+                continue;
+            if (errno == EAGAIN || errno == EWOULDBLOCK)
+                break;
+            std::cerr << "Unable to write audio to file descriptor: " << strerror(errno) << std::endl;
+            return false;
+        }
+        bytes += written;
+        length -= written;
+    }
+    // only whole samples are dropped so that the stream stays aligned, buffer might exceed capacity by one byte
+    size_t keep = std::min(length, capacity - std::min(capacity, pending.size()));
+    keep += (length - keep) % sizeof(int16_t);
+    pending.insert(pending.end(), bytes, bytes + keep);
+    return true;
+}
+#else
+std::unique_ptr<AudioSink> FdAudioSink::open(int fd, size_t buffer_size) {
+    std::cerr << "File descriptor audio sinks are not supported on Windows" << std::endl;
+    return nullptr;
+}
+#endif
+
+AsyncAudioSink::AsyncAudioSink(std::unique_ptr<AudioSink> sink, RecordingMode mode, size_t queue_size,
+                               unsigned int flush_interval)
+        : sink(std::move(sink)), mode(mode), queue(queue_size), flush_interval(flush_interval) {
+    chunk.resize(queue.capacity());
+    if (mode != RECORDING_MODE_INCOMING) {
+        outgoing_queue.resize(queue_size);
+        outgoing_chunk.resize(outgoing_queue.capacity());
+        combined.resize(mode == RECORDING_MODE_STEREO ? 2 * queue.capacity() : queue.capacity());
+    }
+    thread = std::thread(&AsyncAudioSink::run, this);
+}
+
+AsyncAudioSink::~AsyncAudioSink() {
+    {
+        std::lock_guard<std::mutex> lock(mutex);
+        running = false;
+    }
+    cv.notify_one();
+    thread.join();
+    drain(true);
+}
+
+bool AsyncAudioSink::write(const int16_t *buf, size_t size) {
+    enqueue(queue, buf, size);
+    return !failed;
+}
+
+bool AsyncAudioSink::write_outgoing(const int16_t *buf, size_t size) {
+    if (mode != RECORDING_MODE_INCOMING)
+        enqueue(outgoing_queue, buf, size);
+    return !failed;
+}
+
+void AsyncAudioSink::enqueue(AudioRingBuffer &target, const int16_t *buf, size_t size) {
+    size_t count = target.write(buf, size);
+    if (count != size)
+        dropped += size - count;
+    // writer is woken early when the queue is half full, a missed wakeup only delays it until the next flush
+    if (target.size() >= target.capacity() / 2 && !wake_pending.exchange(true))
+        cv.notify_one();
+}
+
+void AsyncAudioSink::run() {
+    std::unique_lock<std::mutex> lock(mutex);
+    while (running) {
+        cv.wait_for(lock, flush_interval, [this] { return !running || wake_pending; });
+        wake_pending = false;
+        lock.unlock();
+        drain(false);
+        lock.lock();
+    }
+}
+
+void AsyncAudioSink::drain(bool final) {
+    const int16_t *output = chunk.data();
+    size_t count;
+    if (mode == RECORDING_MODE_INCOMING) {
+        count = queue.read(chunk.data(), chunk.size());
+    } else {
+        size_t incoming = queue.size();
+        size_t outgoing = outgoing_queue.size();
+        count = std::min(incoming, outgoing);
+        // a stalled direction is padded with silence, so that the other one does not overflow its queue
+        size_t longest = std::max(incoming, outgoing);
+        if (final || longest - count >= queue.capacity() / 2)
+            count = longest;
+        size_t read = queue.read(chunk.data(), count);
+        std::fill(chunk.begin() + read, chunk.begin() + count, 0);
+        read = outgoing_queue.read(outgoing_chunk.data(), count);
+        std::fill(outgoing_chunk.begin() + read, outgoing_chunk.begin() + count, 0);
+        if (mode == RECORDING_MODE_MIXED) {
+            for (size_t i = 0; i < count; ++i) {
+                int32_t sum = chunk[i] + outgoing_chunk[i];
+                combined[i] = static_cast<int16_t>(std::min<int32_t>(std::max<int32_t>(sum, INT16_MIN), INT16_MAX));
+            }
+        } else {
+            for (size_t i = 0; i < count; ++i) {
+                combined[2 * i] = chunk[i];
+                combined[2 * i + 1] = outgoing_chunk[i];
+            }
+            count *= 2;
+        }
+        output = combined.data();
+    }
+    if (count == 0)
+        return;
+    auto start = std::chrono::steady_clock::now();
+    if (!sink->write(output, count))
+        failed = true;
+    auto elapsed = std::chrono::steady_clock::now() - start;
+    int64_t elapsed_us = std::chrono::duration_cast<std::chrono::microseconds>(elapsed).count();
+    written += sizeof(int16_t) * count;
+    ++writes;
+    if (elapsed > flush_interval)
+        ++late_writes;
+    if (elapsed_us > max_write_time)
+        max_write_time = elapsed_us;
+}
+
+RecordingStats AsyncAudioSink::get_stats() const {
+    return RecordingStats {
+        sizeof(int16_t) * (queue.size() + outgoing_queue.size()),
+        sizeof(int16_t) * (queue.capacity() + outgoing_queue.capacity()),
+        written,
+        sizeof(int16_t) * dropped,
+        writes,
+        late_writes,
+        max_write_time / 1e6,
+    };
+}
+
+std::unique_ptr<AudioSink> open_audio_sink(const std::string &path, AudioEncoding encoding, int bitrate,
+                                           unsigned int channels) {
+    FILE *file = fopen(path.c_str(), "wb");
+    if (file == nullptr)
+        return nullptr;
+    if (encoding == AUDIO_ENCODING_OGG_OPUS)
+        return OggOpusSink::open(file, bitrate, channels);
+    return std::unique_ptr<AudioSink>(new RawFileSink(file));
+}
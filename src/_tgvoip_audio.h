@@ -0,0 +1,496 @@
+/*
+ * PytgVoIP - Telegram VoIP Library for Python
+ * Copyright (C) 2020 bakatrouble <https://github.com/bakatrouble>
+ *
+ * This file is part of PytgVoIP.
+ *
+ * PytgVoIP is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Lesser General Public License as published
+ * by the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * PytgVoIP is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License
+ * along with PytgVoIP.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+
+#ifndef PYLIBTGVOIP_AUDIO_H
+#define PYLIBTGVOIP_AUDIO_H
+
+#include <cstddef>
+#include <atomic>
+#include <chrono>
+#include <condition_variable>
+#include <cstdint>
+#include <cstdio>
+#include <list>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <unordered_map>
+#include <vector>
+
+struct OpusDecoder;
+struct OpusEncoder;
+struct WebRtcVadInst;
+
+// lock-free single producer/single consumer ring buffer of samples
+class AudioRingBuffer {
+public:
+    explicit AudioRingBuffer(size_t capacity = 0);
+    void resize(size_t capacity);
+    size_t write(const int16_t *data, size_t count);
+    size_t read(int16_t *data, size_t count);
+    size_t size() const;
+    size_t capacity() const;
+
+private:
+    std::vector<int16_t> buffer;
+    size_t mask = 0;
+    std::atomic<size_t> head{0};
+    std::atomic<size_t> tail{0};
+};
+
+enum AudioEncoding {
+    AUDIO_ENCODING_RAW,
+    AUDIO_ENCODING_OGG_OPUS,
+};
+
+enum RecordingMode {
+    RECORDING_MODE_INCOMING,
+    RECORDING_MODE_MIXED,  // both directions summed into mono
+    RECORDING_MODE_STEREO,  // incoming audio in the left channel, outgoing in the right one
+};
+
+// source of 48 kHz mono 16-bit PCM used by native I/O
+class AudioSource {
+public:
+    virtual ~AudioSource() = default;
+    // returns the number of samples read, less than requested only at the end of the source
+    virtual size_t read(int16_t *buf, size_t size) = 0;
+    virtual void rewind() = 0;
+};
+
+// raw PCM file mapped into memory, reading never touches the disk synchronously unless pages were evicted
+class MappedFile {
+public:
+    static std::unique_ptr<MappedFile> open(const std::string &path, bool preload);
+    ~MappedFile();
+    const uint8_t *data() const;
+    size_t size() const;
+
+private:
+    MappedFile() = default;
+    const uint8_t *ptr = nullptr;
+    size_t length = 0;
+#ifdef _WIN32
+    void *file = nullptr;
+    void *mapping = nullptr;
+#endif
+};
+
+class MappedFileSource : public AudioSource {
+public:
+    explicit MappedFileSource(std::unique_ptr<MappedFile> file);
+    size_t read(int16_t *buf, size_t size) override;
+    void rewind() override;
+
+private:
+    std::unique_ptr<MappedFile> file;
+    size_t position = 0;
+};
+
+// 16-bit PCM WAV file, converted to 48 kHz mono on the fly
+class WavSource : public AudioSource {
+public:
+    // returns nullptr if the format is not supported, file is left untouched in that case
+    static std::unique_ptr<AudioSource> open(std::unique_ptr<MappedFile> &file);
+    size_t read(int16_t *buf, size_t size) override;
+    void rewind() override;
+
+private:
+    WavSource(std::unique_ptr<MappedFile> file, const uint8_t *data, size_t frames, unsigned int channels,
+              unsigned int rate);
+    size_t convert();
+
+    std::unique_ptr<MappedFile> file;
+    const uint8_t *data;
+    size_t frames;
+    unsigned int channels;
+    unsigned int rate;
+    size_t position = 0;
+    // input is converted in chunks which map to a whole number of output samples
+    size_t chunk_in;
+    size_t chunk_out;
+    std::vector<int16_t> mono;
+    std::vector<int16_t> converted;
+    size_t converted_pos = 0;
+    size_t converted_len = 0;
+};
+
+// demuxes packets of the first logical stream of a memory-mapped Ogg file
+class OggReader {
+public:
+    OggReader(const uint8_t *data, size_t size);
+    // returns false at the end of the stream, packet stays valid until the next call
+    // granule is -1 unless the packet is the last one completed on its page
+    bool next_packet(const uint8_t *&packet, size_t &length, int64_t &granule, bool &eos);
+    void rewind();
+
+private:
+    bool next_page();
+
+    const uint8_t *data;
+    size_t size;
+    size_t offset = 0;
+    bool serial_set = false;
+    uint32_t serial = 0;
+    // current page
+    uint8_t header_type = 0;
+    int64_t page_granule = -1;
+    const uint8_t *lacing = nullptr;
+    size_t segments = 0;
+    size_t segment = 0;
+    const uint8_t *body = nullptr;
+    size_t body_offset = 0;
+    // packets spanning several pages are reassembled here
+    std::vector<uint8_t> packet_buffer;
+};
+
+// Ogg/Opus file decoded to 48 kHz mono on the fly, one packet is decoded ahead at most
+class OggOpusSource : public AudioSource {
+public:
+    // returns nullptr if the file is not a supported Ogg/Opus file
+    static std::unique_ptr<AudioSource> open(std::unique_ptr<MappedFile> &file);
+    ~OggOpusSource() override;
+    size_t read(int16_t *buf, size_t size) override;
+    void rewind() override;
+
+private:
+    OggOpusSource(std::unique_ptr<MappedFile> file, OpusDecoder *decoder, unsigned int pre_skip);
+    size_t decode();
+
+    std::unique_ptr<MappedFile> file;
+    OggReader reader;
+    OpusDecoder *decoder;
+    unsigned int pre_skip;
+    int64_t skip = 0;  // samples left to discard at the beginning
+    int64_t position = 0;  // samples returned since the beginning
+    bool finished = false;
+    std::vector<int16_t> decoded;
+    size_t decoded_pos = 0;
+    size_t decoded_len = 0;
+};
+
+// raw 48 kHz mono PCM stream read from a pipe or a socket without blocking,
+// playback starts once the jitter buffer is filled and is resumed the same way after underruns
+class FdAudioSource : public AudioSource {
+public:
+    // duplicates the descriptor and switches it to non-blocking mode, returns nullptr on failure
+    static std::unique_ptr<AudioSource> open(int fd, size_t prebuffer);
+    ~FdAudioSource() override;
+    // silence is returned while buffering, less than requested only after end of stream
+    size_t read(int16_t *buf, size_t size) override;
+    // streams can not be rewound
+    void rewind() override;
+
+private:
+    FdAudioSource(int fd, size_t prebuffer);
+    void fill();
+
+    int fd;
+    size_t prebuffer;
+    AudioRingBuffer buffer;
+    std::vector<int16_t> chunk;
+    uint8_t partial = 0;  // odd byte of an incomplete sample
+    bool has_partial = false;
+    bool buffering = true;
+    bool eof = false;
+};
+
+// sums concurrently playing sources into outgoing frames, not thread-safe
+class AudioMixer {
+public:
+    AudioMixer();
+    // returns source ID
+    int add(std::unique_ptr<AudioSource> source, float gain, float duck_gain, bool loop);
+    // returns removed source so it can be destroyed outside of the audio thread's critical section
+    std::unique_ptr<AudioSource> remove(int id);
+    bool set_gain(int id, float gain, float duck_gain);
+    std::vector<std::unique_ptr<AudioSource>> clear();
+    bool empty() const;
+    // adds sources to buf with saturation, ducked gain is used while ducking is true
+    // finished sources which do not loop are removed
+    void mix(int16_t *buf, size_t size, bool ducking);
+
+private:
+    struct Channel {
+        int id;
+        std::unique_ptr<AudioSource> source;
+        float gain;
+        float duck_gain;
+        bool loop;
+        float current_gain;  // gain applied at the end of the previous frame, changes are ramped over a frame
+    };
+
+    std::vector<Channel> channels;
+    std::vector<int16_t> samples;
+    std::vector<int32_t> sum;
+    int next_id = 1;
+};
+
+struct AssetCacheStats {
+    size_t size;
+    size_t capacity;
+    size_t assets;
+    uint64_t hits;
+    uint64_t misses;
+    uint64_t evictions;
+};
+
+// process-wide LRU cache of decoded 48 kHz mono PCM keyed by path and modification time,
+// sources opened from it share decoded samples and only keep their own read position
+class AssetCache {
+public:
+    // cache is disabled when capacity is 0, which is the default
+    static void set_capacity(size_t capacity);
+    static bool enabled();
+    static AssetCacheStats get_stats();
+    static void clear();
+    // returns nullptr if the file could not be opened, assets larger than capacity are streamed from the file
+    static std::unique_ptr<AudioSource> open(const std::string &path, bool preload);
+
+private:
+    struct Entry {
+        std::string path;
+        int64_t mtime;  // nanoseconds
+        uint64_t file_size;
+        std::shared_ptr<const std::vector<int16_t>> samples;
+    };
+
+    static AssetCache &instance();
+    void evict();
+
+    std::mutex mutex;
+    std::list<Entry> entries;  // most recently used first
+    std::unordered_map<std::string, std::list<Entry>::iterator> index;
+    size_t size = 0;
+    size_t capacity = 0;
+    uint64_t hits = 0;
+    uint64_t misses = 0;
+    uint64_t evictions = 0;
+};
+
+// WebRTC voice activity detector with hangover, 48 kHz mono input is processed in 10 ms blocks
+class VoiceActivityDetector {
+public:
+    // aggressiveness is 0..3, hangover is in milliseconds
+    VoiceActivityDetector(int aggressiveness, unsigned int hangover);
+    ~VoiceActivityDetector();
+    // returns whether speech was detected in the frame or within hangover before it
+    bool process(const int16_t *buf, size_t size);
+    bool active() const;
+
+private:
+    WebRtcVadInst *vad;
+    size_t hangover;  // samples
+    size_t silence = 0;  // samples since the last voiced block
+    bool voiced = false;
+};
+
+// lock-free level counters updated by the audio thread and read from any other thread
+// rms and peak cover audio processed since the previous read, clipping count is cumulative
+class AudioLevelMeter {
+public:
+    void process(const int16_t *buf, size_t size);
+    // both are relative to full scale and reset the respective counters
+    float take_rms();
+    float take_peak();
+    uint64_t clipped() const;
+
+private:
+    std::atomic<uint64_t> sum_squares{0};
+    std::atomic<uint64_t> samples{0};
+    std::atomic<int> peak{0};
+    std::atomic<uint64_t> clipped_samples{0};
+};
+
+struct LatencyStats {
+    uint64_t count;
+    double mean;  // seconds
+    double max;
+    double p50;  // bucket upper bounds, not exceeding max
+    double p90;
+    double p99;
+    // buckets[0] counts durations below 1 us, buckets[i] durations from 2^(i-1) to 2^i us,
+    // the last bucket also counts all longer durations
+    std::vector<uint64_t> buckets;
+};
+
+// lock-free log2-bucketed histogram of durations in microseconds, recorded and read from any thread
+class LatencyHistogram {
+public:
+    static const size_t BUCKETS = 26;
+
+    void record(uint64_t us);
+    LatencyStats get_stats() const;
+    void reset();
+
+private:
+    std::atomic<uint64_t> buckets[BUCKETS] = {};
+    std::atomic<uint64_t> total{0};
+    std::atomic<uint64_t> max{0};
+};
+
+// duration of audio callbacks, intervals between them and number of callbacks exceeding the frame duration
+class CallbackTiming {
+public:
+    void record(std::chrono::steady_clock::time_point start, size_t frame_size);
+    void reset();
+
+    LatencyHistogram duration;
+    LatencyHistogram interval;
+    std::atomic<uint64_t> late{0};
+
+private:
+    std::chrono::steady_clock::time_point last{};  // touched only by the recording thread
+};
+
+// detects file format by its header (WAV or Ogg/Opus), raw 48 kHz mono PCM is assumed if it is not recognized
+// decoded samples are taken from the asset cache if it is enabled
+std::unique_ptr<AudioSource> open_audio_source(const std::string &path, bool preload);
+
+// consumer of 48 kHz mono 16-bit PCM recorded by native I/O, the stream is finalized on destruction
+class AudioSink {
+public:
+    virtual ~AudioSink() = default;
+    // returns false on write errors
+    virtual bool write(const int16_t *buf, size_t size) = 0;
+};
+
+class RawFileSink : public AudioSink {
+public:
+    explicit RawFileSink(FILE *file);
+    ~RawFileSink() override;
+    bool write(const int16_t *buf, size_t size) override;
+
+private:
+    FILE *file;
+};
+
+// encodes 20 ms Opus packets and muxes them into one-second Ogg pages, stereo input is interleaved
+class OggOpusSink : public AudioSink {
+public:
+    // returns nullptr if the encoder could not be created
+    static std::unique_ptr<AudioSink> open(FILE *file, int bitrate, unsigned int channels);
+    ~OggOpusSink() override;
+    bool write(const int16_t *buf, size_t size) override;
+
+private:
+    OggOpusSink(FILE *file, OpusEncoder *encoder, unsigned int channels, unsigned int pre_skip);
+    bool write_headers();
+    bool encode_frame();
+    bool add_packet(const uint8_t *data, size_t length);
+    bool flush_page(bool eos);
+    bool write_header(const uint8_t *data, size_t length, uint8_t header_type);
+    bool write_page(uint8_t header_type, int64_t granule);
+
+    FILE *file;
+    OpusEncoder *encoder;
+    unsigned int channels;
+    unsigned int pre_skip;
+    uint32_t serial;
+    uint32_t sequence = 0;
+    uint64_t samples = 0;  // samples per channel written by the caller
+    uint64_t encoded = 0;  // samples per channel passed to the encoder, including padding
+    std::vector<int16_t> frame;
+    size_t frame_len = 0;
+    std::vector<uint8_t> packet;
+    std::vector<uint8_t> page_lacing;
+    std::vector<uint8_t> page_body;
+    size_t page_packets = 0;
+    uint64_t page_granule = 0;  // end of the last packet on the current page
+    bool ok = true;
+};
+
+// raw PCM written to a pipe or a socket without blocking, audio the reader is not ready for is kept
+// in a bounded buffer and newest audio is dropped when it is full
+class FdAudioSink : public AudioSink {
+public:
+    // duplicates the descriptor and switches it to non-blocking mode, returns nullptr on failure
+    static std::unique_ptr<AudioSink> open(int fd, size_t buffer_size);
+    ~FdAudioSink() override;
+    // returns false once the reader has gone away
+    bool write(const int16_t *buf, size_t size) override;
+
+private:
+    FdAudioSink(int fd, size_t buffer_size);
+    bool flush();
+
+    int fd;
+    size_t capacity;  // bytes
+    std::vector<uint8_t> pending;
+};
+
+struct RecordingStats {
+    size_t queued;
+    size_t capacity;
+    uint64_t written;
+    uint64_t dropped;
+    uint64_t writes;
+    uint64_t late_writes;
+    double max_write_time;
+};
+
+// queues samples for a writer thread which passes them to the wrapped sink in large chunks,
+// so that slow disks never block the audio thread
+// when both directions are recorded they are combined by sample position, every direction has its own queue
+class AsyncAudioSink : public AudioSink {
+public:
+    AsyncAudioSink(std::unique_ptr<AudioSink> sink, RecordingMode mode, size_t queue_size,
+                   unsigned int flush_interval);
+    // drains the queues and finalizes the wrapped sink
+    ~AsyncAudioSink() override;
+    // incoming audio, never blocks, samples which do not fit into the queue are dropped
+    bool write(const int16_t *buf, size_t size) override;
+    // outgoing audio, ignored in incoming-only mode
+    bool write_outgoing(const int16_t *buf, size_t size);
+    RecordingStats get_stats() const;
+
+private:
+    void enqueue(AudioRingBuffer &target, const int16_t *buf, size_t size);
+    void run();
+    void drain(bool final);
+
+    std::unique_ptr<AudioSink> sink;
+    RecordingMode mode;
+    AudioRingBuffer queue;
+    AudioRingBuffer outgoing_queue;
+    std::vector<int16_t> chunk;
+    std::vector<int16_t> outgoing_chunk;
+    std::vector<int16_t> combined;
+    std::chrono::milliseconds flush_interval;
+    std::mutex mutex;
+    std::condition_variable cv;
+    bool running = true;
+    std::atomic<bool> wake_pending{false};
+    std::atomic<bool> failed{false};
+    std::atomic<uint64_t> written{0};
+    std::atomic<uint64_t> dropped{0};
+    std::atomic<uint64_t> writes{0};
+    std::atomic<uint64_t> late_writes{0};
+    std::atomic<int64_t> max_write_time{0};  // microseconds
+    std::thread thread;
+};
+
+// opens a sink writing to a newly created file, returns nullptr on failure
+std::unique_ptr<AudioSink> open_audio_sink(const std::string &path, AudioEncoding encoding, int bitrate,
+                                           unsigned int channels);
+
+#endif
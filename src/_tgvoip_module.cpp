@@ -72,6 +72,23 @@ PYBIND11_MODULE(_tgvoip, m) {
             .value("PROXY", CallError::ERROR_PROXY)
             .export_values();
 
+    py::enum_<EventDispatch>(m, "EventDispatch")
+            .value("SYNC", EventDispatch::EVENT_DISPATCH_SYNC)
+            .value("THREAD", EventDispatch::EVENT_DISPATCH_THREAD)
+            .value("LOOP", EventDispatch::EVENT_DISPATCH_LOOP)
+            .export_values();
+
+    py::enum_<AudioEncoding>(m, "AudioEncoding")
+            .value("RAW", AudioEncoding::AUDIO_ENCODING_RAW)
+            .value("OGG_OPUS", AudioEncoding::AUDIO_ENCODING_OGG_OPUS)
+            .export_values();
+
+    py::enum_<RecordingMode>(m, "RecordingMode")
+            .value("INCOMING", RecordingMode::RECORDING_MODE_INCOMING)
+            .value("MIXED", RecordingMode::RECORDING_MODE_MIXED)
+            .value("STEREO", RecordingMode::RECORDING_MODE_STEREO)
+            .export_values();
+
     py::class_<Stats>(m, "Stats")
             .def_readonly("bytes_sent_wifi", &Stats::bytes_sent_wifi)
             .def_readonly("bytes_sent_mobile", &Stats::bytes_sent_mobile)
@@ -87,6 +104,162 @@ PYBIND11_MODULE(_tgvoip, m) {
                 return repr.str();
             });
 
+    py::class_<QualityStats>(m, "QualityStats")
+            .def_readonly("state", &QualityStats::state)
+            .def_readonly("signal_bars", &QualityStats::signal_bars)
+            .def_readonly("rtt", &QualityStats::rtt)
+            .def_readonly("preferred_relay_id", &QualityStats::preferred_relay_id)
+            .def_readonly("last_error", &QualityStats::last_error)
+            .def_readonly("bytes_sent", &QualityStats::bytes_sent)
+            .def_readonly("bytes_recvd", &QualityStats::bytes_recvd)
+            .def_readonly("send_bitrate", &QualityStats::send_bitrate)
+            .def_readonly("recv_bitrate", &QualityStats::recv_bitrate)
+            .def("__repr__", [](const QualityStats &s) {
+                std::ostringstream repr;
+                repr << "<_tgvoip.QualityStats ";
+                repr << "state=" << s.state << " ";
+                repr << "signal_bars=" << s.signal_bars << " ";
+                repr << "rtt=" << s.rtt << " ";
+                repr << "preferred_relay_id=" << s.preferred_relay_id << " ";
+                repr << "last_error=" << s.last_error << " ";
+                repr << "bytes_sent=" << s.bytes_sent << " ";
+                repr << "bytes_recvd=" << s.bytes_recvd << " ";
+                repr << "send_bitrate=" << s.send_bitrate << " ";
+                repr << "recv_bitrate=" << s.recv_bitrate << ">";
+                return repr.str();
+            });
+
+    py::class_<BufferStats>(m, "BufferStats")
+            .def_readonly("send_buffered", &BufferStats::send_buffered)
+            .def_readonly("send_capacity", &BufferStats::send_capacity)
+            .def_readonly("recv_buffered", &BufferStats::recv_buffered)
+            .def_readonly("recv_capacity", &BufferStats::recv_capacity)
+            .def_readonly("send_underruns", &BufferStats::send_underruns)
+            .def_readonly("send_overruns", &BufferStats::send_overruns)
+            .def_readonly("recv_overruns", &BufferStats::recv_overruns)
+            .def("__repr__", [](const BufferStats &s) {
+                std::ostringstream repr;
+                repr << "<_tgvoip.BufferStats ";
+                repr << "send_buffered=" << s.send_buffered << " ";
+                repr << "send_capacity=" << s.send_capacity << " ";
+                repr << "recv_buffered=" << s.recv_buffered << " ";
+                repr << "recv_capacity=" << s.recv_capacity << " ";
+                repr << "send_underruns=" << s.send_underruns << " ";
+                repr << "send_overruns=" << s.send_overruns << " ";
+                repr << "recv_overruns=" << s.recv_overruns << ">";
+                return repr.str();
+            });
+
+    py::class_<LatencyStats>(m, "LatencyStats")
+            .def_readonly("count", &LatencyStats::count)
+            .def_readonly("mean", &LatencyStats::mean)
+            .def_readonly("max", &LatencyStats::max)
+            .def_readonly("p50", &LatencyStats::p50)
+            .def_readonly("p90", &LatencyStats::p90)
+            .def_readonly("p99", &LatencyStats::p99)
+            .def_readonly("buckets", &LatencyStats::buckets)
+            .def("__repr__", [](const LatencyStats &s) {
+                std::ostringstream repr;
+                repr << "<_tgvoip.LatencyStats ";
+                repr << "count=" << s.count << " ";
+                repr << "mean=" << s.mean << " ";
+                repr << "max=" << s.max << " ";
+                repr << "p50=" << s.p50 << " ";
+                repr << "p90=" << s.p90 << " ";
+                repr << "p99=" << s.p99 << ">";
+                return repr.str();
+            });
+
+    py::class_<AudioTimingStats>(m, "AudioTimingStats")
+            .def_readonly("send_duration", &AudioTimingStats::send_duration)
+            .def_readonly("send_interval", &AudioTimingStats::send_interval)
+            .def_readonly("send_late", &AudioTimingStats::send_late)
+            .def_readonly("recv_duration", &AudioTimingStats::recv_duration)
+            .def_readonly("recv_interval", &AudioTimingStats::recv_interval)
+            .def_readonly("recv_late", &AudioTimingStats::recv_late)
+            .def("__repr__", [](const AudioTimingStats &s) {
+                std::ostringstream repr;
+                repr << "<_tgvoip.AudioTimingStats ";
+                repr << "send_count=" << s.send_duration.count << " ";
+                repr << "send_p99=" << s.send_duration.p99 << " ";
+                repr << "send_late=" << s.send_late << " ";
+                repr << "recv_count=" << s.recv_duration.count << " ";
+                repr << "recv_p99=" << s.recv_duration.p99 << " ";
+                repr << "recv_late=" << s.recv_late << ">";
+                return repr.str();
+            });
+
+    py::class_<GilStats>(m, "GilStats")
+            .def_readonly("wait", &GilStats::wait)
+            .def_readonly("hold", &GilStats::hold)
+            .def("__repr__", [](const GilStats &s) {
+                std::ostringstream repr;
+                repr << "<_tgvoip.GilStats ";
+                repr << "count=" << s.wait.count << " ";
+                repr << "wait_p99=" << s.wait.p99 << " ";
+                repr << "hold_p99=" << s.hold.p99 << ">";
+                return repr.str();
+            });
+
+    py::class_<AudioLevels>(m, "AudioLevels")
+            .def_readonly("send_rms", &AudioLevels::send_rms)
+            .def_readonly("send_peak", &AudioLevels::send_peak)
+            .def_readonly("send_clipped", &AudioLevels::send_clipped)
+            .def_readonly("recv_rms", &AudioLevels::recv_rms)
+            .def_readonly("recv_peak", &AudioLevels::recv_peak)
+            .def_readonly("recv_clipped", &AudioLevels::recv_clipped)
+            .def("__repr__", [](const AudioLevels &s) {
+                std::ostringstream repr;
+                repr << "<_tgvoip.AudioLevels ";
+                repr << "send_rms=" << s.send_rms << " ";
+                repr << "send_peak=" << s.send_peak << " ";
+                repr << "send_clipped=" << s.send_clipped << " ";
+                repr << "recv_rms=" << s.recv_rms << " ";
+                repr << "recv_peak=" << s.recv_peak << " ";
+                repr << "recv_clipped=" << s.recv_clipped << ">";
+                return repr.str();
+            });
+
+    py::class_<RecordingStats>(m, "RecordingStats")
+            .def_readonly("queued", &RecordingStats::queued)
+            .def_readonly("capacity", &RecordingStats::capacity)
+            .def_readonly("written", &RecordingStats::written)
+            .def_readonly("dropped", &RecordingStats::dropped)
+            .def_readonly("writes", &RecordingStats::writes)
+            .def_readonly("late_writes", &RecordingStats::late_writes)
+            .def_readonly("max_write_time", &RecordingStats::max_write_time)
+            .def("__repr__", [](const RecordingStats &s) {
+                std::ostringstream repr;
+                repr << "<_tgvoip.RecordingStats ";
+                repr << "queued=" << s.queued << " ";
+                repr << "capacity=" << s.capacity << " ";
+                repr << "written=" << s.written << " ";
+                repr << "dropped=" << s.dropped << " ";
+                repr << "writes=" << s.writes << " ";
+                repr << "late_writes=" << s.late_writes << " ";
+                repr << "max_write_time=" << s.max_write_time << ">";
+                return repr.str();
+            });
+
+    py::class_<AssetCacheStats>(m, "AssetCacheStats")
+            .def_readonly("size", &AssetCacheStats::size)
+            .def_readonly("capacity", &AssetCacheStats::capacity)
+            .def_readonly("assets", &AssetCacheStats::assets)
+            .def_readonly("hits", &AssetCacheStats::hits)
+            .def_readonly("misses", &AssetCacheStats::misses)
+            .def_readonly("evictions", &AssetCacheStats::evictions)
+            .def("__repr__", [](const AssetCacheStats &s) {
+                std::ostringstream repr;
+                repr << "<_tgvoip.AssetCacheStats ";
+                repr << "size=" << s.size << " ";
+                repr << "capacity=" << s.capacity << " ";
+                repr << "assets=" << s.assets << " ";
+                repr << "hits=" << s.hits << " ";
+                repr << "misses=" << s.misses << " ";
+                repr << "evictions=" << s.evictions << ">";
+                return repr.str();
+            });
+
     py::class_<Endpoint>(m, "Endpoint")
             .def(py::init<long long, const std::string &, const std::string &, int, const py::bytes &>())
             .def_readwrite("_id", &Endpoint::id)
@@ -144,6 +317,9 @@ PYBIND11_MODULE(_tgvoip, m) {
             .def("get_preferred_relay_id", &VoIPController::get_preferred_relay_id)
             .def("get_last_error", &VoIPController::get_last_error)
             .def("get_stats", &VoIPController::get_stats)
+            .def("get_quality_stats", &VoIPController::get_quality_stats)
+            .def("set_stats_sampling", &VoIPController::set_stats_sampling)
+            .def("get_stats_history", &VoIPController::get_stats_history)
             .def("get_debug_log", &VoIPController::get_debug_log)
             .def("set_audio_output_gain_control_enabled", &VoIPController::set_audio_output_gain_control_enabled)
             .def("set_echo_cancellation_strength", &VoIPController::set_echo_cancellation_strength)
@@ -159,25 +335,73 @@ PYBIND11_MODULE(_tgvoip, m) {
 
             /* .def("_handle_state_change", &VoIPController::_handle_state_change)
             .def("_handle_signal_bars_change", &VoIPController::_handle_signal_bars_change)
+            .def("_handle_voice_activity_change", &VoIPController::_handle_voice_activity_change)
             .def("_send_audio_frame_impl", &VoIPController::_send_audio_frame_impl)
             .def("_recv_audio_frame_impl", &VoIPController::_recv_audio_frame_impl) */
 
             .def("_native_io_get", &VoIPController::_native_io_get)
             .def("_native_io_set", &VoIPController::_native_io_set)
+            .def("_send_zero_copy_set", &VoIPController::_send_zero_copy_set)
+            .def("_recv_zero_copy_set", &VoIPController::_recv_zero_copy_set)
+            .def("_send_ndarray_set", &VoIPController::_send_ndarray_set)
+            .def("_recv_ndarray_set", &VoIPController::_recv_ndarray_set)
+            .def("_buffered_io_get", &VoIPController::_buffered_io_get)
+            .def("_buffered_io_set", &VoIPController::_buffered_io_set)
+            .def("set_audio_buffer_size", &VoIPController::set_audio_buffer_size)
+            .def("set_callback_batching", &VoIPController::set_callback_batching)
+            .def("_flush_recv_batch", &VoIPController::_flush_recv_batch)
+            .def("set_send_prefetch", &VoIPController::set_send_prefetch)
+            .def("write_audio", &VoIPController::write_audio)
+            .def("read_audio", &VoIPController::read_audio)
+            .def("get_buffer_stats", &VoIPController::get_buffer_stats)
+            .def("get_audio_levels", &VoIPController::get_audio_levels)
+            .def("get_audio_timing_stats", &VoIPController::get_audio_timing_stats)
+            .def("reset_audio_timing_stats", &VoIPController::reset_audio_timing_stats)
+            .def("get_gil_stats", &VoIPController::get_gil_stats)
+            .def("reset_gil_stats", &VoIPController::reset_gil_stats)
+            .def_static("get_process_gil_stats", &VoIPController::get_process_gil_stats)
+            .def_static("reset_process_gil_stats", &VoIPController::reset_process_gil_stats)
+            .def("_set_notify_fd", &VoIPController::_set_notify_fd)
+            .def("_wait_recv_audio", &VoIPController::_wait_recv_audio)
+            .def("_wait_send_audio", &VoIPController::_wait_send_audio)
+            .def("set_event_dispatch", &VoIPController::set_event_dispatch)
+            .def("get_event_dispatch", &VoIPController::get_event_dispatch)
+            .def("_get_state", &VoIPController::_get_state)
+            .def("wait_for_state", &VoIPController::wait_for_state)
+            .def("_set_finished", &VoIPController::_set_finished)
+            .def("_poll_events", &VoIPController::_poll_events)
             .def("play", &VoIPController::play)
+            .def("play_buffer", &VoIPController::play_buffer)
             .def("play_on_hold", &VoIPController::play_on_hold)
             .def("set_output_file", &VoIPController::set_output_file)
+            .def("add_mix_source", &VoIPController::add_mix_source)
+            .def("remove_mix_source", &VoIPController::remove_mix_source)
+            .def("set_mix_source_gain", &VoIPController::set_mix_source_gain)
+            .def("clear_mix_sources", &VoIPController::clear_mix_sources)
             .def("clear_play_queue", &VoIPController::clear_play_queue)
             .def("clear_hold_queue", &VoIPController::clear_hold_queue)
             .def("unset_output_file", &VoIPController::unset_output_file)
+            .def("play_fd", &VoIPController::play_fd)
+            .def("set_output_fd", &VoIPController::set_output_fd)
+            .def("unset_output_fd", &VoIPController::unset_output_fd)
+            .def("get_recording_stats", &VoIPController::get_recording_stats)
+            .def("set_voice_activity_detection", &VoIPController::set_voice_activity_detection)
 
             .def_readonly("persistent_state_file", &VoIPController::persistent_state_file)
+            .def_readwrite("call_id", &VoIPController::call_id)
             .def_property_readonly_static("LIBTGVOIP_VERSION", &VoIPController::get_version)
             .def_property_readonly_static("CONNECTION_MAX_LAYER", &VoIPController::connection_max_layer);
 
     py::class_<VoIPServerConfig>(m, "VoIPServerConfig")
             .def_static("set_config", &VoIPServerConfig::set_config);
 
+    py::class_<AssetCache>(m, "AssetCache")
+            .def_static("set_capacity", &AssetCache::set_capacity)
+            .def_static("get_stats", &AssetCache::get_stats)
+            .def_static("clear", &AssetCache::clear);
+
+    m.def("get_stats_snapshot", &VoIPController::get_stats_snapshot);
+
 #ifdef VERSION_INFO
     m.attr("__version__") = VERSION_INFO;
 #else
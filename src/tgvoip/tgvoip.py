@@ -16,26 +16,48 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with PytgVoIP.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import json
 import os
+import socket
 import sys
+import warnings
+import weakref
 from datetime import datetime
 from enum import Enum
-from typing import Union, List
+from typing import Union, List, Optional
 
 from _tgvoip import (
     NetType as _NetType,
     DataSaving as _DataSaving,
     CallState as _CallState,
     CallError as _CallError,
+    EventDispatch as _EventDispatch,
+    AudioEncoding as _AudioEncoding,
+    RecordingMode as _RecordingMode,
     Stats,
+    QualityStats,
+    BufferStats,
+    AudioLevels,
+    LatencyStats,
+    AudioTimingStats,
+    GilStats,
+    RecordingStats,
+    AssetCacheStats,
     Endpoint,
     VoIPController as _VoIPController,
-    VoIPServerConfig as _VoIPServerConfig
+    VoIPServerConfig as _VoIPServerConfig,
+    AssetCache as _AssetCache,
+    get_stats_snapshot as _get_stats_snapshot
 )
 
 from tgvoip.utils import get_real_elapsed_time
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 # docstring magic ahead
 
@@ -140,6 +162,146 @@ class CallError(Enum):
     PROXY = _CallError.PROXY
 
 
+class EventDispatch(Enum):
+    """
+    An enumeration of call state and signal bars change handlers dispatch modes
+
+    Members:
+        * SYNC = 0 (handlers are called on ``libtgvoip`` thread which waits for them to return)
+        * THREAD = 1 (events are queued and handlers are called on a dedicated dispatcher thread)
+        * LOOP = 2 (events are queued and handlers are called by an ``asyncio`` event loop)
+    """
+    SYNC = _EventDispatch.SYNC
+    THREAD = _EventDispatch.THREAD
+    LOOP = _EventDispatch.LOOP
+
+
+class AudioEncoding(Enum):
+    """
+    An enumeration of native I/O output file encodings
+
+    Members:
+        * RAW = 0 (raw 48 kHz mono 16-bit PCM)
+        * OGG_OPUS = 1 (Opus in Ogg container, encoded while the call is running)
+    """
+    RAW = _AudioEncoding.RAW
+    OGG_OPUS = _AudioEncoding.OGG_OPUS
+
+
+class RecordingMode(Enum):
+    """
+    An enumeration of native I/O output file contents
+
+    Members:
+        * INCOMING = 0 (incoming audio only)
+        * MIXED = 1 (incoming and outgoing audio summed into a mono stream)
+        * STEREO = 2 (incoming audio in the left channel, outgoing audio in the right one)
+    """
+    INCOMING = _RecordingMode.INCOMING
+    MIXED = _RecordingMode.MIXED
+    STEREO = _RecordingMode.STEREO
+
+
+def _get_running_loop() -> asyncio.AbstractEventLoop:
+    # asyncio.get_running_loop() is only available since Python 3.7
+    if sys.version_info >= (3, 7):
+        return asyncio.get_running_loop()
+    return asyncio.get_event_loop()
+
+
+class _EventLoopNotifier:
+    """
+    Wakes coroutines waiting on native buffers, native code writes a byte to a socket pair watched by the event loop
+
+    Controller is only weakly referenced, notifier is closed on the event loop once the controller is collected
+    """
+
+    def __init__(self, controller: 'VoIPController', loop: asyncio.AbstractEventLoop):
+        self._controller = weakref.ref(controller)
+        self.loop = loop
+        self.finished = False
+        self._closed = False
+        self._waiters = []
+        self._rsock, self._wsock = socket.socketpair()
+        self._rsock.setblocking(False)
+        self._wsock.setblocking(False)
+        try:
+            loop.add_reader(self._rsock.fileno(), self._on_readable)
+        except NotImplementedError:
+            self._rsock.close()
+            self._wsock.close()
+            raise RuntimeError('event loop can\'t watch sockets, use asyncio.SelectorEventLoop') from None
+        controller._set_notify_fd(self._wsock.fileno())
+        weakref.finalize(controller, self.close_soon)
+
+    def wait(self) -> asyncio.Future:
+        future = self.loop.create_future()
+        self._waiters.append(future)
+        return future
+
+    def wake(self):
+        try:
+            self._wsock.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.finished = True
+        controller = self._controller()
+        if controller is not None:
+            controller._set_notify_fd(-1)
+        self.loop.remove_reader(self._rsock.fileno())
+        self._rsock.close()
+        self._wsock.close()
+        self._on_readable()
+
+    def close_soon(self):
+        try:
+            self.loop.call_soon_threadsafe(self.close)
+        except RuntimeError:  # event loop is closed
+            pass
+
+    def _on_readable(self):
+        try:
+            while self._rsock.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        try:
+            controller = self._controller()
+            if controller is not None and controller.get_event_dispatch() == EventDispatch.LOOP:
+                controller._dispatch_events(self.loop)
+        finally:
+            waiters, self._waiters = self._waiters, []
+            for future in waiters:
+                if not future.done():
+                    future.set_result(None)
+
+
+class _IncomingAudioStream:
+    def __init__(self, controller: 'VoIPController', min_length: int):
+        self.controller = controller
+        self.min_length = min_length
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        notifier = self.controller._get_event_loop_notifier(_get_running_loop())
+        while True:
+            if self.controller._wait_recv_audio(self.min_length):
+                return self.controller.read_audio()
+            if notifier.finished:
+                chunk = self.controller.read_audio()
+                if not chunk:
+                    raise StopAsyncIteration
+                return chunk
+            await notifier.wait()
+
+
 class VoIPController(_VoIPController):
     """
     A wrapper around C++ wrapper for libtgvoip ``VoIPController``
@@ -160,11 +322,18 @@ class VoIPController(_VoIPController):
         persistent_state_file:
             Value set in the constructor
 
+        call_id:
+            Call ID set by :meth:`set_config`, used to identify the call in :func:`get_stats_snapshot`
+
         call_state_changed_handlers:
             ``list`` of call state change callbacks, callbacks receive a :class:`CallState` object as argument
 
         signal_bars_changed_handlers
             ``list`` of signal bars count change callbacks, callbacks receive an ``int`` object as argument
+
+        voice_activity_changed_handlers
+            ``list`` of incoming voice activity change callbacks, callbacks receive a ``bool`` object as argument \
+            (see :meth:`set_voice_activity_detection`)
     """
 
     def __init__(self, persistent_state_file: str = '', debug=False, logs_dir='logs'):
@@ -176,6 +345,8 @@ class VoIPController(_VoIPController):
         self.recv_audio_frame_callback = lambda frame: ...
         self.call_state_changed_handlers = []
         self.signal_bars_changed_handlers = []
+        self.voice_activity_changed_handlers = []
+        self._event_loop_notifier = None
         self._init()
 
     @property
@@ -335,6 +506,7 @@ class VoIPController(_VoIPController):
             status_dump_path = self._get_log_file_path('voip_stats') if self.debug else ''
         if log_packet_stats is None:
             log_packet_stats = self.debug
+        self.call_id = call_id
         super().set_config(recv_timeout, init_timeout, _DataSaving(data_saving_mode.value), enable_aec, enable_ns, enable_agc,
                            log_file_path, status_dump_path, log_packet_stats)
 
@@ -379,6 +551,56 @@ class VoIPController(_VoIPController):
         """
         return super().get_stats()
 
+    def get_quality_stats(self) -> QualityStats:
+        """
+        Get call quality indicators without building debug strings
+
+        Bitrates are computed between the two latest samples collected by :meth:`set_stats_sampling`, so they are \
+        ``0`` until sampling is enabled and two samples are taken. Packet loss and jitter buffer delay are not \
+        available, ``libtgvoip`` doesn't expose them outside of debug strings
+
+        Returns:
+            :class:`QualityStats` object
+        """
+        return super().get_quality_stats()
+
+    def set_stats_sampling(self, interval: int = 1000, capacity: int = 3600) -> None:
+        """
+        Sample traffic and quality counters on a native thread at a fixed interval into a ring buffer, oldest \
+        samples are overwritten once it is full. Previously collected samples are dropped
+
+        Args:
+            interval (``int``, *optional*): Sampling interval in milliseconds, ``0`` disables sampling, \
+                defaults to 1000
+            capacity (``int``, *optional*): Number of samples kept, defaults to 3600
+
+        Raises:
+            :class:`ValueError` if interval or capacity is negative
+        """
+        if interval < 0 or capacity < 0:
+            raise ValueError('interval and capacity must be non-negative')
+        super().set_stats_sampling(interval, capacity)
+
+    def get_stats_history(self, ndarray: bool = False) -> dict:
+        """
+        Get samples collected since :meth:`set_stats_sampling` was called, oldest first
+
+        Result maps column names to contiguous arrays of equal length: ``time`` (monotonic clock in seconds, \
+        ``float``), ``bytes_sent`` and ``bytes_recvd`` (all networks, ``int``), ``rtt`` (seconds, ``float``), \
+        ``signal_bars`` and ``state`` (:class:`CallState` value, ``int``)
+
+        Args:
+            ndarray (``bool``, *optional*): Return ``numpy.ndarray`` columns instead of typed ``memoryview`` \
+                objects, defaults to ``False``
+
+        Returns:
+            ``dict`` of ``memoryview`` or ``numpy.ndarray`` objects
+        """
+        history = super().get_stats_history()
+        if self._check_ndarray_support(ndarray):
+            history = {name: numpy.asarray(column) for name, column in history.items()}
+        return history
+
     def get_debug_log(self) -> str:
         """
         Get debug log
@@ -444,38 +666,499 @@ class VoIPController(_VoIPController):
         """
         self._native_io_set(val)
 
-    def play(self, path: str) -> bool:
+    @property
+    def buffered_io(self) -> bool:
+        """
+        Get buffered I/O status (audio is exchanged through native ring buffers, see :meth:`write_audio` and \
+        :meth:`read_audio`)
+
+        Returns:
+            ``bool`` status (enabled or not)
+        """
+        return self._buffered_io_get()
+
+    @buffered_io.setter
+    def buffered_io(self, val: bool) -> None:
+        """
+        Set buffered I/O status. In this mode audio thread never calls Python code (and never takes the GIL), \
+        callbacks are not used. Native I/O takes precedence if both are enabled
+
+        Args:
+            val (``bool``): Status value
+        """
+        self._buffered_io_set(val)
+
+    def set_audio_buffer_size(self, send_size: int = 96000, recv_size: int = 96000) -> None:
+        """
+        Resize ring buffers used by buffered I/O, buffered audio is discarded. Capacity is rounded up to a power of \
+        two samples. Must not be called concurrently with :meth:`write_audio` or :meth:`read_audio`
+
+        Args:
+            send_size (``int``, *optional*): Outgoing buffer size in bytes, defaults to 1 second of audio
+            recv_size (``int``, *optional*): Incoming buffer size in bytes, defaults to 1 second of audio
+        """
+        super().set_audio_buffer_size(send_size, recv_size)
+
+    def write_audio(self, data: bytes) -> int:
+        """
+        Append outgoing audio to the buffered I/O ring buffer. Data that does not fit is dropped and counted as an \
+        overrun
+
+        Args:
+            data (``bytes``-like): Audio data encoded in 16-bit signed PCM, any C-contiguous buffer is accepted
+
+        Returns:
+            ``int`` number of bytes actually buffered
+        """
+        return super().write_audio(data)
+
+    def read_audio(self, max_length: int = -1) -> bytes:
+        """
+        Take incoming audio from the buffered I/O ring buffer
+
+        Args:
+            max_length (``int``, *optional*): Maximum amount of bytes to return, everything available by default
+
+        Returns:
+            ``bytes`` with audio data encoded in 16-bit signed PCM, might be empty
+        """
+        return super().read_audio(max_length)
+
+    def get_buffer_stats(self) -> BufferStats:
+        """
+        Get buffered I/O fill levels and underrun/overrun counters
+
+        Returns:
+            :class:`BufferStats` object
+        """
+        return super().get_buffer_stats()
+
+    def get_audio_levels(self) -> AudioLevels:
+        """
+        Get sent and received audio levels, measured natively on every audio frame
+
+        RMS and peak levels cover audio processed since the previous call, so polling at a fixed interval yields \
+        per-interval levels
+
+        Returns:
+            :class:`AudioLevels` object
+        """
+        return super().get_audio_levels()
+
+    def get_audio_timing_stats(self) -> AudioTimingStats:
+        """
+        Get histograms of ``libtgvoip`` audio callback durations and intervals between callbacks, along with numbers \
+        of callbacks which took longer than the frame they produced or consumed. Durations include waiting for \
+        the GIL and for Python callbacks
+
+        Returns:
+            :class:`AudioTimingStats` object
+        """
+        return super().get_audio_timing_stats()
+
+    def reset_audio_timing_stats(self) -> None:
+        """
+        Reset audio callback timing histograms and counters
+        """
+        super().reset_audio_timing_stats()
+
+    def get_gil_stats(self) -> GilStats:
+        """
+        Get histograms of time native code of this controller spent waiting for the GIL before invoking Python \
+        callbacks and handlers and of time it held the GIL while they were running
+
+        Returns:
+            :class:`GilStats` object
+        """
+        return super().get_gil_stats()
+
+    def reset_gil_stats(self) -> None:
+        """
+        Reset GIL timing histograms of this controller
+        """
+        super().reset_gil_stats()
+
+    @classmethod
+    def get_process_gil_stats(cls) -> GilStats:
+        """
+        Get GIL wait and hold time histograms combined for all controllers in the process
+
+        Returns:
+            :class:`GilStats` object
+        """
+        return _VoIPController.get_process_gil_stats()
+
+    @classmethod
+    def reset_process_gil_stats(cls) -> None:
+        """
+        Reset process-wide GIL timing histograms, per-controller histograms are not affected
+        """
+        _VoIPController.reset_process_gil_stats()
+
+    def incoming_audio(self, min_length: int = 9600) -> '_IncomingAudioStream':
+        """
+        Get an asynchronous iterator over incoming audio, requires buffered I/O to be enabled. Iteration stops once \
+        the call fails or ends, or after :meth:`close_audio_streams` is called
+
+        Coroutines are woken at most once per ``min_length`` bytes of buffered audio, each step yields everything \
+        buffered at that moment::
+
+            async for chunk in controller.incoming_audio():
+                ...
+
+        Args:
+            min_length (``int``, *optional*): Minimum amount of bytes to wait for, defaults to 100 ms of audio
+
+        Returns:
+            Asynchronous iterator yielding ``bytes`` with audio data encoded in 16-bit signed PCM
+
+        Raises:
+            :class:`RuntimeError` if buffered I/O is not enabled, iteration raises it if event loop doesn't support \
+                watching sockets
+        """
+        if not self.buffered_io:
+            raise RuntimeError('buffered I/O must be enabled to use audio streams')
+        return _IncomingAudioStream(self, min_length)
+
+    async def send_audio(self, data: bytes) -> None:
+        """
+        Queue outgoing audio for buffered I/O, waiting for free space in the ring buffer if needed
+
+        Args:
+            data (``bytes``-like): Audio data encoded in 16-bit signed PCM, any C-contiguous buffer is accepted
+
+        Raises:
+            :class:`RuntimeError` if buffered I/O is not enabled or event loop doesn't support watching sockets
+
+            :class:`ValueError` if data contains an incomplete sample
+
+            :class:`ConnectionResetError` if the call has ended or :meth:`close_audio_streams` was called before \
+                all data was queued
+        """
+        if not self.buffered_io:
+            raise RuntimeError('buffered I/O must be enabled to use audio streams')
+        view = memoryview(data).cast('B')
+        if len(view) % 2:
+            raise ValueError('data length must be a multiple of 2 bytes but is {}'.format(len(view)))
+        notifier = self._get_event_loop_notifier(_get_running_loop())
+        capacity = self.get_buffer_stats().send_capacity
+        while len(view):
+            length = min(len(view), capacity)
+            if not self._wait_send_audio(length):
+                if notifier.finished:
+                    raise ConnectionResetError('audio stream is closed')
+                await notifier.wait()
+                continue
+            view = view[self.write_audio(view[:length]):]
+
+    def set_event_dispatch(self, mode: EventDispatch, loop: asyncio.AbstractEventLoop = None) -> None:
+        """
+        Choose how call state and signal bars change handlers are invoked
+
+        In :attr:`EventDispatch.LOOP` mode handlers are called synchronously once the event loop is detached by \
+        :meth:`close_audio_streams` or after the call has ended
+
+        Args:
+            mode (:class:`EventDispatch`): Dispatch mode, :attr:`EventDispatch.SYNC` is used by default
+            loop (``asyncio.AbstractEventLoop``, *optional*): Event loop for :attr:`EventDispatch.LOOP` mode, \
+                current event loop is used if not provided. Only one event loop per controller is supported
+
+        Raises:
+            :class:`RuntimeError` if event loop doesn't support watching sockets
+        """
+        if mode == EventDispatch.LOOP:
+            self._get_event_loop_notifier(loop).wake()
+        super().set_event_dispatch(_EventDispatch(mode.value))
+
+    def get_event_dispatch(self) -> EventDispatch:
+        """
+        Get current handlers dispatch mode
+
+        Returns:
+            :class:`EventDispatch` value
+        """
+        return EventDispatch(super().get_event_dispatch())
+
+    def wait_for_state(self, state: CallState, timeout: float = None) -> bool:
+        """
+        Block until ``libtgvoip`` reports the given call state, the GIL is released while waiting. Waiting is also \
+        finished if the call fails or ends or the controller is destroyed
+
+        Args:
+            state (:class:`CallState`): State to wait for, one of the states reported by ``libtgvoip`` \
+                (``WAIT_INIT`` to ``RECONNECTING``)
+            timeout (``float``, *optional*): Timeout in seconds, waits indefinitely if not provided
+
+        Returns:
+            ``bool`` whether the state was reached
+
+        Raises:
+            :class:`ValueError` if state is never reported by ``libtgvoip``
+        """
+        self._check_native_state(state)
+        return super().wait_for_state(_CallState(state.value), -1 if timeout is None else timeout)
+
+    async def state_reached(self, state: CallState) -> bool:
         """
-        Add a file to play queue for native I/O
+        Wait asynchronously until ``libtgvoip`` reports the given call state. Waiting is also finished if the call \
+        fails or :meth:`close_audio_streams` is called
+
+        Args:
+            state (:class:`CallState`): State to wait for, one of the states reported by ``libtgvoip`` \
+                (``WAIT_INIT`` to ``RECONNECTING``)
+
+        Returns:
+            ``bool`` whether the state was reached
+
+        Raises:
+            :class:`ValueError` if state is never reported by ``libtgvoip``
+
+            :class:`RuntimeError` if event loop doesn't support watching sockets
+        """
+        self._check_native_state(state)
+        notifier = self._get_event_loop_notifier(_get_running_loop())
+        while True:
+            current = self._get_state()
+            if current == int(state.value):
+                return True
+            if current == int(CallState.FAILED.value) or notifier.finished:
+                return False
+            await notifier.wait()
+
+    def close_audio_streams(self) -> None:
+        """
+        Stop asynchronous audio streams and detach from the event loop. Must be called from the event loop thread
+
+        Streams are also stopped automatically once the call fails or ends
+        """
+        if self._event_loop_notifier is not None:
+            self._event_loop_notifier.close()
+            self._event_loop_notifier = None
+
+    @staticmethod
+    def _check_native_state(state: CallState):
+        # other states are only set by update_state()
+        if not isinstance(state.value, _CallState):
+            raise ValueError('{} is never reported by libtgvoip'.format(state))
+
+    def _get_event_loop_notifier(self, loop: asyncio.AbstractEventLoop = None) -> _EventLoopNotifier:
+        if self._event_loop_notifier is None:
+            self._event_loop_notifier = _EventLoopNotifier(self, loop or asyncio.get_event_loop())
+        return self._event_loop_notifier
+
+    def play(self, path: str, preload: bool = False) -> bool:
+        """
+        Add a file to play queue for native I/O. File is memory-mapped, readahead is started immediately
+
+        File can be raw 48 kHz mono 16-bit PCM, a 16-bit PCM WAV file with any sample rate and channel count or \
+        a mono/stereo Ogg/Opus file. WAV and Opus files are converted to 48 kHz mono while playing
 
         Args:
             path (``str``): File path
+            preload (``bool``, *optional*): Whether to read the whole file into page cache before returning, \
+                defaults to ``False``
+
+        Returns:
+            ``bool`` whether opening the file was successful. File is not added to queue on failure or if it is \
+            a WAV or Ogg file in unsupported format.
+        """
+        return super().play(path, preload)
+
+    def play_fd(self, fd: Union[int, 'io.IOBase'], jitter_buffer: int = 60) -> bool:
+        """
+        Add a raw 48 kHz mono 16-bit PCM stream to play queue for native I/O, e.g. a pipe from ``ffmpeg`` or a Unix \
+        socket. Stream is read without blocking, playback starts after ``jitter_buffer`` of audio was received and \
+        silence is sent while the buffer is refilled after underruns. Stream is removed from queue on end of stream
+
+        Descriptor is duplicated, so it can be closed by the caller, but it is switched to non-blocking mode. Not \
+        supported on Windows
+
+        Args:
+            fd (``int`` | file object): Readable file descriptor or an object with ``fileno()`` method
+            jitter_buffer (``int``, *optional*): Amount of audio in milliseconds to buffer before playback starts, \
+                defaults to 60
 
         Returns:
-            ``bool`` whether opening the file was successful. File is not added to queue on failure.
+            ``bool`` whether the descriptor could be used
+
+        Raises:
+            :class:`ValueError` if jitter buffer size is negative
         """
-        return super().play(path)
+        if jitter_buffer < 0:
+            raise ValueError('jitter_buffer must be non-negative')
+        if not isinstance(fd, int):
+            fd = fd.fileno()
+        return super().play_fd(fd, jitter_buffer)
 
-    def play_on_hold(self, paths: List[str]) -> None:
+    def play_buffer(self, data: Union[bytes, bytearray, memoryview, 'numpy.ndarray']) -> None:
         """
-        Replace the hold queue for native I/O
+        Add in-memory audio to play queue for native I/O. Audio is read directly from the object's memory, \
+        a reference to it is kept until playback finishes or the queue is cleared
+
+        Mutable objects must not be modified while queued, resizing is prevented by the buffer protocol
+
+        Args:
+            data (``bytes`` | ``bytearray`` | ``memoryview`` | ``numpy.ndarray``): C-contiguous 48 kHz mono \
+                16-bit PCM, either raw bytes or an array of ``int16``
+
+        Raises:
+            :class:`ValueError` if data is not bytes-like or an array of ``int16``, or its length is odd
+        """
+        with memoryview(data) as view:
+            if view.format.lstrip('@=<') not in ('B', 'b', 'c', 'h'):
+                raise ValueError('data must be bytes-like or an array of int16')
+            if view.nbytes % 2:
+                raise ValueError('data length must be even')
+        super().play_buffer(data)
+
+    def play_on_hold(self, paths: List[str], preload: bool = False) -> None:
+        """
+        Replace the hold queue for native I/O. Files are memory-mapped, readahead is started immediately
+
+        Files are handled in the same way as in :meth:`play`, files which failed to open are skipped
 
         Args:
             paths (``list`` of ``str``): List of file paths
+            preload (``bool``, *optional*): Whether to read whole files into page cache before returning, \
+                defaults to ``False``
         """
-        super().play_on_hold(paths)
+        super().play_on_hold(paths, preload)
 
-    def set_output_file(self, path: str) -> bool:
+    def set_output_file(self, path: str, encoding: AudioEncoding = AudioEncoding.RAW, bitrate: int = 32000,
+                        mode: RecordingMode = RecordingMode.INCOMING, queue_duration: int = 10000,
+                        flush_interval: int = 1000) -> bool:
         """
-        Set output file for native I/O
+        Set call recording output file, recording works with any I/O mode. Previous output file is finalized and \
+        closed
+
+        Outgoing audio is captured after it has been produced by native I/O, buffered I/O or the send callback. When \
+        both directions are recorded they are aligned by sample position, a stalled direction is padded with silence
+
+        Audio is queued in memory and written (and encoded) on a dedicated thread, so disk stalls never block \
+        ``libtgvoip`` audio thread. Audio which does not fit into the queue is dropped, see :meth:`get_recording_stats`
 
         Args:
             path (``str``): File path
+            encoding (:class:`AudioEncoding`, *optional*): Output file encoding, defaults to \
+                :attr:`AudioEncoding.RAW`
+            bitrate (``int``, *optional*): Bitrate in bits per second for :attr:`AudioEncoding.OGG_OPUS`, \
+                defaults to 32000
+            mode (:class:`RecordingMode`, *optional*): Recorded directions, defaults to \
+                :attr:`RecordingMode.INCOMING`
+            queue_duration (``int``, *optional*): Queue size in milliseconds of audio per direction, defaults to 10000
+            flush_interval (``int``, *optional*): Interval in milliseconds between writes, defaults to 1000. Writes \
+                also happen as soon as the queue is half full
 
         Returns:
             ``bool`` whether opening the file was successful. Output file is not replaced on failure.
+
+        Raises:
+            :class:`ValueError` if bitrate is not in 6000..510000 range or queue duration or flush interval \
+                are not positive
+        """
+        if not 6000 <= bitrate <= 510000:
+            raise ValueError('bitrate must be in 6000..510000 range')
+        if queue_duration <= 0 or flush_interval <= 0:
+            raise ValueError('queue_duration and flush_interval must be positive')
+        return super().set_output_file(path, _AudioEncoding(encoding.value), bitrate, _RecordingMode(mode.value),
+                                       queue_duration, flush_interval)
+
+    def set_output_fd(self, fd: Union[int, 'io.IOBase'], buffer_duration: int = 200) -> bool:
+        """
+        Write received audio as raw 48 kHz mono 16-bit PCM to a pipe or a socket for native I/O, e.g. to a local \
+        speech recognition daemon. Descriptor is written without blocking, audio the reader is not ready for is \
+        buffered and newest audio is dropped when the buffer is full. Output stops when the reader goes away
+
+        Descriptor is duplicated, so it can be closed by the caller, but it is switched to non-blocking mode. Not \
+        supported on Windows
+
+        Args:
+            fd (``int`` | file object): Writable file descriptor or an object with ``fileno()`` method
+            buffer_duration (``int``, *optional*): Buffer size in milliseconds of audio, defaults to 200
+
+        Returns:
+            ``bool`` whether the descriptor could be used. Previous descriptor is not replaced on failure.
+
+        Raises:
+            :class:`ValueError` if buffer duration is negative
+        """
+        if buffer_duration < 0:
+            raise ValueError('buffer_duration must be non-negative')
+        if not isinstance(fd, int):
+            fd = fd.fileno()
+        return super().set_output_fd(fd, buffer_duration)
+
+    def unset_output_fd(self) -> None:
+        """
+        Stop writing received audio to the descriptor set with :meth:`set_output_fd` and close its duplicate
+        """
+        super().unset_output_fd()
+
+    def add_mix_source(self, path: str, gain: float = 1.0, duck_gain: float = 1.0, loop: bool = False,
+                       preload: bool = False) -> Optional[int]:
         """
-        return super().set_output_file(path)
+        Add a file to be mixed into outgoing audio for native I/O, on top of play and hold queues. Any number of \
+        sources can be played at once, their sum is saturated to 16-bit range
+
+        Files are handled in the same way as in :meth:`play`. Finished sources are removed unless ``loop`` is set
+
+        Args:
+            path (``str``): File path
+            gain (``float``, *optional*): Linear gain, defaults to 1.0
+            duck_gain (``float``, *optional*): Additional linear gain applied while the play queue is not empty, \
+                e.g. 0.25 to lower background music during announcements, defaults to 1.0
+            loop (``bool``, *optional*): Whether to restart the file when it ends, defaults to ``False``
+            preload (``bool``, *optional*): Whether to read the whole file into page cache before returning, \
+                defaults to ``False``
+
+        Returns:
+            ``int`` mix source ID or ``None`` if opening the file failed
+
+        Raises:
+            :class:`ValueError` if gains are negative
+        """
+        if gain < 0 or duck_gain < 0:
+            raise ValueError('gains must be non-negative')
+        source_id = super().add_mix_source(path, gain, duck_gain, loop, preload)
+        return source_id if source_id != -1 else None
+
+    def remove_mix_source(self, source_id: int) -> bool:
+        """
+        Stop and remove a mix source
+
+        Args:
+            source_id (``int``): Mix source ID returned by :meth:`add_mix_source`
+
+        Returns:
+            ``bool`` whether the source was found, it might have finished already
+        """
+        return super().remove_mix_source(source_id)
+
+    def set_mix_source_gain(self, source_id: int, gain: float, duck_gain: float = 1.0) -> bool:
+        """
+        Change mix source gains, the change is ramped over a frame to avoid clicks
+
+        Args:
+            source_id (``int``): Mix source ID returned by :meth:`add_mix_source`
+            gain (``float``): Linear gain
+            duck_gain (``float``, *optional*): Additional linear gain applied while the play queue is not empty, \
+                defaults to 1.0
+
+        Returns:
+            ``bool`` whether the source was found, it might have finished already
+
+        Raises:
+            :class:`ValueError` if gains are negative
+        """
+        if gain < 0 or duck_gain < 0:
+            raise ValueError('gains must be non-negative')
+        return super().set_mix_source_gain(source_id, gain, duck_gain)
+
+    def clear_mix_sources(self) -> None:
+        """
+        Stop and remove all mix sources
+        """
+        super().clear_mix_sources()
 
     def clear_play_queue(self) -> None:
         """
@@ -491,10 +1174,46 @@ class VoIPController(_VoIPController):
 
     def unset_output_file(self) -> None:
         """
-        Unset the output file for native I/O
+        Unset the call recording output file, queued audio is written and the file is finalized before returning
         """
         super().unset_output_file()
 
+    def get_recording_stats(self) -> RecordingStats:
+        """
+        Get native output file writer queue state and counters, counters are reset when output file is replaced
+
+        Returns:
+            :class:`RecordingStats` object
+        """
+        return super().get_recording_stats()
+
+    def set_voice_activity_detection(self, enabled: bool, aggressiveness: int = 2, hangover: int = 300,
+                                     gate_callback: bool = False) -> None:
+        """
+        Enable or disable voice activity detection on incoming audio
+
+        Changes are reported to :attr:`voice_activity_changed_handlers`, detector state is reset on every call. \
+        Detection runs on the audio thread which never calls handlers itself, in :attr:`EventDispatch.SYNC` mode (or \
+        :attr:`EventDispatch.LOOP` mode without an attached event loop) they are called on the main thread instead
+
+        Args:
+            enabled (``bool``): Whether detection is enabled
+            aggressiveness (``int``, *optional*): Detector aggressiveness from 0 (least likely to drop speech) to 3 \
+                (least likely to report non-speech as speech), defaults to 2
+            hangover (``int``, *optional*): Time in milliseconds audio is still considered speech after the last \
+                voiced fragment, defaults to 300
+            gate_callback (``bool``, *optional*): Do not invoke receive audio frame callback for frames without \
+                speech, defaults to False
+
+        Raises:
+            :class:`ValueError` if aggressiveness is not in range 0..3 or hangover is negative
+        """
+        if not 0 <= aggressiveness <= 3:
+            raise ValueError('aggressiveness must be in range 0..3')
+        if hangover < 0:
+            raise ValueError('hangover must be non-negative')
+        super().set_voice_activity_detection(enabled, aggressiveness, hangover, gate_callback)
+
     # native code callback
     def _handle_state_change(self, state: _CallState):
         state = CallState(state)
@@ -502,6 +1221,14 @@ class VoIPController(_VoIPController):
         if state == CallState.ESTABLISHED and not self.start_time:
             self.start_time = get_real_elapsed_time()
 
+        if state in (CallState.FAILED, CallState.ENDED):
+            self._flush_recv_batch()
+            self._set_finished()
+
+        if state in (CallState.FAILED, CallState.ENDED) and self._event_loop_notifier is not None:
+            self._event_loop_notifier.finished = True
+            self._event_loop_notifier.close_soon()
+
         for handler in self.call_state_changed_handlers:
             callable(handler) and handler(state)
 
@@ -510,6 +1237,27 @@ class VoIPController(_VoIPController):
         for handler in self.signal_bars_changed_handlers:
             callable(handler) and handler(count)
 
+    # native code callback
+    def _handle_voice_activity_change(self, active: bool):
+        for handler in self.voice_activity_changed_handlers:
+            callable(handler) and handler(active)
+
+    def _dispatch_events(self, loop: asyncio.AbstractEventLoop):
+        for event_type, value in self._poll_events():
+            # events are already dequeued, a failing handler must not drop the rest
+            try:
+                if event_type == 0:  # state change
+                    self._handle_state_change(_CallState(value))
+                elif event_type == 1:  # signal bars change
+                    self._handle_signal_bars_change(value)
+                else:  # voice activity change
+                    self._handle_voice_activity_change(bool(value))
+            except Exception as e:
+                loop.call_exception_handler({
+                    'message': 'Exception in call event handler',
+                    'exception': e,
+                })
+
     def update_state(self, state: CallState):
         """
         Manually update state (only triggers handlers)
@@ -519,7 +1267,7 @@ class VoIPController(_VoIPController):
         """
         self._handle_state_change(state)
 
-    def set_send_audio_frame_callback(self, func: callable):
+    def set_send_audio_frame_callback(self, func: callable, zero_copy: bool = False, ndarray: bool = False):
         """
         Set callback providing audio data to send
 
@@ -528,10 +1276,63 @@ class VoIPController(_VoIPController):
 
         If returned object has insufficient length, it will be automatically padded with zero bytes
 
+        If ``zero_copy`` is enabled, callback receives a writable ``memoryview`` (format ``'h'``, one item per sample) \
+        over the native frame buffer instead and should write samples into it in place, return value is ignored. \
+        The buffer is filled with silence beforehand and is only valid until the callback returns. If views derived \
+        from it (slices, casts) are kept afterwards, a :class:`RuntimeWarning` is issued and later frames are passed \
+        as copies
+
+        If ``ndarray`` is enabled, callback receives a writable ``numpy.ndarray`` of ``int16`` over the native frame \
+        buffer in the same manner, the array counts as a derived view. Falls back to ``memoryview`` with a warning \
+        if NumPy is not installed
+
         Args:
             func (``callable``): Callback function
+            zero_copy (``bool``, *optional*): Whether to fill the native buffer in place, defaults to ``False``
+            ndarray (``bool``, *optional*): Whether to fill the native buffer in place through a NumPy array, \
+                defaults to ``False``
         """
         self.send_audio_frame_callback = func
+        self._send_zero_copy_set(zero_copy or ndarray)
+        self._send_ndarray_set(self._check_ndarray_support(ndarray))
+
+    def set_callback_batching(self, send_duration: int = 0, recv_duration: int = 0):
+        """
+        Coalesce several audio frames into a single callback invocation
+
+        Send callback is asked for ``send_duration`` worth of audio ahead of time which is then sent frame by frame, \
+        receive callback gets ``recv_duration`` worth of concatenated frames at once. Durations should be multiples \
+        of 20 ms (libtgvoip frame duration), values up to one frame disable batching for that direction
+
+        Incomplete receive batch is delivered immediately when batching is reconfigured and once the call fails or ends
+
+        Args:
+            send_duration (``int``, *optional*): Send batch duration in milliseconds, defaults to ``0``
+            recv_duration (``int``, *optional*): Receive batch duration in milliseconds, defaults to ``0``
+        """
+        if send_duration < 0 or recv_duration < 0:
+            raise ValueError('batch duration can\'t be negative')
+        super().set_callback_batching(send_duration, recv_duration)
+
+    def set_send_prefetch(self, frames: int = 0):
+        """
+        Call send callback on a helper thread ahead of time so that ``libtgvoip`` audio thread never waits for Python
+
+        Up to ``frames`` frames of ``libtgvoip`` frame size are requested in advance and queued natively, \
+        prefetching starts with the first frame ``libtgvoip`` sends. Audio thread only takes frames from the queue \
+        and sends silence if it is empty, such frames are counted in \
+        :attr:`BufferStats.send_underruns`. Producer delays shorter than the prefetch depth are absorbed, but sent \
+        audio is delayed by up to the same amount. Used with send callback only, combines with callback batching
+
+        Args:
+            frames (``int``, *optional*): Prefetch depth in frames, ``0`` disables prefetching, defaults to ``0``
+
+        Raises:
+            :class:`ValueError` if prefetch depth is negative
+        """
+        if frames < 0:
+            raise ValueError('prefetch depth can\'t be negative')
+        super().set_send_prefetch(frames)
 
     def _send_audio_frame_impl(self, length: int):
         frame = b''
@@ -539,21 +1340,49 @@ class VoIPController(_VoIPController):
             frame = self.send_audio_frame_callback(length)
         return frame.ljust(length, b'\0')
 
-    def set_recv_audio_frame_callback(self, func: callable):
+    def _send_audio_frame_view_impl(self, frame: memoryview):
+        if callable(self.send_audio_frame_callback):
+            self.send_audio_frame_callback(frame)
+
+    def set_recv_audio_frame_callback(self, func: callable, zero_copy: bool = False, ndarray: bool = False):
         """
         Set callback receiving incoming audio data
 
         Should accept one argument (``bytes``) with audio data encoded in 16-bit signed PCM
 
+        If ``zero_copy`` is enabled, callback receives a read-only ``memoryview`` (format ``'h'``, one item per \
+        sample) over the native frame buffer instead of ``bytes``. The view is only valid until the callback returns, \
+        copy the data if it is needed later. If views derived from it (slices, casts) are kept afterwards, \
+        a :class:`RuntimeWarning` is issued and later frames are passed as copies
+
+        If ``ndarray`` is enabled, callback receives a read-only ``numpy.ndarray`` of ``int16`` over the native frame \
+        buffer in the same manner, the array counts as a derived view. Falls back to ``memoryview`` with a warning \
+        if NumPy is not installed
+
         Args:
             func (``callable``): Callback function
+            zero_copy (``bool``, *optional*): Whether to pass a view over the native buffer, defaults to ``False``
+            ndarray (``bool``, *optional*): Whether to pass a NumPy array over the native buffer, defaults to ``False``
         """
         self.recv_audio_frame_callback = func
+        self._recv_zero_copy_set(zero_copy or ndarray)
+        self._recv_ndarray_set(self._check_ndarray_support(ndarray))
 
     def _recv_audio_frame_impl(self, frame: bytes):
         if callable(self.recv_audio_frame_callback):
             self.recv_audio_frame_callback(frame)
 
+    def _recv_audio_frame_view_impl(self, frame: memoryview):
+        if callable(self.recv_audio_frame_callback):
+            self.recv_audio_frame_callback(frame)
+
+    @staticmethod
+    def _check_ndarray_support(ndarray: bool) -> bool:
+        if ndarray and numpy is None:
+            warnings.warn('NumPy is not installed, memoryview will be used instead', RuntimeWarning)
+            return False
+        return ndarray
+
     def _get_log_file_path(self, name: str) -> str:
         os.makedirs(self.logs_dir, exist_ok=True)
         now = datetime.now()
@@ -643,5 +1472,71 @@ class VoIPServerConfig(_VoIPServerConfig):
         })
 
 
-__all__ = ['NetType', 'DataSaving', 'CallState', 'CallError', 'Stats', 'Endpoint', 'VoIPController',
-           'VoIPServerConfig']
+class AssetCache(_AssetCache):
+    """
+    Process-wide cache of decoded audio files used by native I/O. When enabled, files passed to \
+    :meth:`VoIPController.play`, :meth:`VoIPController.play_on_hold` and :meth:`VoIPController.add_mix_source` are \
+    decoded to 48 kHz mono PCM once and shared between all controllers. Entries are keyed by path and modification \
+    time and evicted in least recently used order when the cache exceeds its capacity, sources which are still \
+    playing keep evicted audio alive. Files which don't fit into the cache are streamed as if it was disabled
+    """
+
+    @classmethod
+    def set_capacity(cls, capacity: int) -> None:
+        """
+        Set cache capacity, cache is disabled by default
+
+        Args:
+            capacity (``int``): Capacity in bytes of decoded audio (96000 bytes per second), 0 disables the cache \
+                and drops all entries
+
+        Raises:
+            :class:`ValueError` if capacity is negative
+        """
+        if capacity < 0:
+            raise ValueError('capacity must be non-negative')
+        _AssetCache.set_capacity(capacity)
+
+    @classmethod
+    def get_stats(cls) -> AssetCacheStats:
+        """
+        Get cache fill level and counters
+
+        Returns:
+            :class:`AssetCacheStats` object
+        """
+        return _AssetCache.get_stats()
+
+    @classmethod
+    def clear(cls) -> None:
+        """
+        Drop all cache entries, sources which are still playing are not affected
+        """
+        _AssetCache.clear()
+
+
+def get_stats_snapshot(ndarray: bool = False) -> dict:
+    """
+    Get stats of all live controllers at once, collected natively under a single lock
+
+    Result maps column names to contiguous arrays of equal length, one element per controller: ``call_id``, \
+    ``state`` (:class:`CallState` value), ``signal_bars``, ``bytes_sent_wifi``, ``bytes_sent_mobile``, \
+    ``bytes_recvd_wifi`` and ``bytes_recvd_mobile``
+
+    Args:
+        ndarray (``bool``, *optional*): Return ``numpy.ndarray`` columns instead of typed ``memoryview`` objects, \
+            defaults to ``False``
+
+    Returns:
+        ``dict`` of ``memoryview`` or ``numpy.ndarray`` objects
+    """
+    snapshot = _get_stats_snapshot()
+    if VoIPController._check_ndarray_support(ndarray):
+        snapshot = {name: numpy.asarray(column) for name, column in snapshot.items()}
+    return snapshot
+
+
+__all__ = ['NetType', 'DataSaving', 'CallState', 'CallError', 'EventDispatch', 'AudioEncoding', 'RecordingMode',
+           'Stats', 'QualityStats', 'BufferStats', 'AudioLevels', 'LatencyStats', 'AudioTimingStats', 'GilStats',
+           'RecordingStats', 'AssetCacheStats', 'Endpoint', 'VoIPController', 'VoIPServerConfig', 'AssetCache',
+           'get_stats_snapshot']